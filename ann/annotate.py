@@ -10,11 +10,25 @@
 ##
 __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
+import array
+import bisect
+import threading
+from collections import Counter, OrderedDict
+
+import bloom_filter as bf
 import file_utils as fu
+import interval_index as ii
 import utils as u
 
 indicesKnownGenes=[12, 1, 3] #12 for gene
 
+"""Exon boundaries of recently hit transcripts, shared by every job in the
+   worker and evicted least recently used first
+"""
+TRANSCRIPT_CACHE_SIZE = 20000
+transcriptCache = OrderedDict()
+transcriptCacheLock = threading.Lock()
+
 def collapseGeneNames(row, indices, region, cnt):
     names = ['bin', 'name', 'chrom', 'transcriptStrand', 'txStart', 'txEnd', 
         'cdsStart', 'cdsEnd', 'exonCount', 'exonStarts', 'exonEnds', 'score',
@@ -30,6 +44,53 @@ def collapseGeneNames(row, indices, region, cnt):
     return  ';'.join(collapsed)
 
 
+"""Exon starts and ends of a refGene row as integer arrays, parsed once per
+   transcript; ordered tells whether the exons are sorted and disjoint
+"""
+def getTranscriptExons(row, exonCount):
+    key = (row[9], row[10], exonCount)
+    with transcriptCacheLock:
+        exons = transcriptCache.get(key)
+        if (exons is not None):
+            transcriptCache.move_to_end(key)
+            return exons
+
+    exonsSt = str(row[9].decode("utf-8")).split(',')
+    exonsEn = str(row[10].decode("utf-8")).split(',')
+    starts = array.array('q', [int(exonsSt[e]) for e in range(0, exonCount)])
+    ends = array.array('q', [int(exonsEn[e]) for e in range(0, exonCount)])
+    ordered = True
+    for e in range(1, exonCount):
+        if (starts[e] < starts[e - 1]) or (ends[e] < ends[e - 1]):
+            ordered = False
+            break
+    exons = (starts, ends, ordered)
+
+    with transcriptCacheLock:
+        transcriptCache[key] = exons
+        if (len(transcriptCache) > TRANSCRIPT_CACHE_SIZE):
+            transcriptCache.popitem(last=False)
+
+    return exons
+
+
+"""Indices of the exons holding pos, in exon order
+"""
+def findExons(exons, pos):
+    starts, ends, ordered = exons
+    if not ordered:
+        return [e for e in range(0, len(starts)) 
+            if u.isBetween(pos, starts[e], ends[e])]
+
+    hits = []
+    e = bisect.bisect_right(starts, pos) - 1
+    while (e >= 0) and (ends[e] >= pos):
+        hits.append(e)
+        e = e - 1
+    hits.reverse()
+    return hits
+
+
 """"Collapces bigRefSegTable
 """
 def collapseRefSeq(line):
@@ -107,89 +168,437 @@ def getComplementary(nuc):
         return compNuc
 
 
-""""Format must be pileup or vcf
-    Types of variants in dbSNP135: DIV, SNV, MNV, MIXED
-""" 
-def getSnpsFromDbSnp(vcf, format='vcf', tmpextin='', tmpextout='.1',
-    varclass='SNV', sep='\t'):
-    
-    outfile = vcf + tmpextout
-    fh_out = open(outfile, "w")
-    logcountfile = vcf + '.count.log'
-    fh_log = open(logcountfile, 'w')
-    var_count = 0
+"""One data line, parsed once and handed to every annotation step
+   chr is the bare chromosome name, chrom the "chr"-prefixed one and 
+   chrom_key the bare name upper-cased, for matching either form
+   INFO is kept as a list of fragments the steps append to, joined once
+   when the record is written (getFields/getLine); fields[7] is stale 
+   until then, so steps read INFO with getInfo, or its entries with 
+   getInfoField, parsed once until INFO changes
+   With exact_info, getInfoField matches entry names exactly instead of
+   by substring like utils.parse_field
+"""
+class VariantRecord(object):
+    __slots__ = ('fields', 'chr', 'chrom', 'chrom_key', 'pos', 'ref', 'alt',
+        'info', 'info_map', 'exact_info')
+
+    def __init__(self, fields, inds, exact_info=False):
+        chr = fields[inds[0]].strip()
+        if chr.startswith("chr"):
+            self.chr = chr.replace('chr', '')
+            self.chrom = chr
+        else:
+            self.chr = chr
+            self.chrom = "chr" + chr
+
+        self.chrom_key = self.chr.upper()
+        self.pos = fields[inds[1]].strip()
+        self.ref = clean_mysql_chars(fields[inds[2]]).strip()
+        self.alt = clean_mysql_chars(fields[inds[3]]).strip()
+        self.exact_info = exact_info
+        self.setFields(fields)
+
+    def setFields(self, fields):
+        self.fields = fields
+        self.info = [fields[7]] if (len(fields) > 7) else None
+        self.info_map = None
+
+    def getInfo(self):
+        if (len(self.info) > 1):
+            self.info = [''.join(self.info)]
+        return self.info[0]
+
+    def setInfo(self, info):
+        self.info = [info]
+        self.info_map = None
+
+    """Value of the first INFO entry named name, '.' when there is none; 
+       without exact_info, of the first entry whose name contains name
+       An entry without a value raises IndexError, as in utils.parse_field
+    """
+    def getInfoField(self, name):
+        if (self.info_map is None):
+            self.info_map = {}
+            for f in clean_mysql_chars(self.getInfo()).strip().split(';'):
+                pairs = f.split('=')
+                self.info_map.setdefault(pairs[0], pairs)
+
+        if self.exact_info:
+            pairs = self.info_map.get(name)
+        else:
+            # Names keep the order they first appear in, so the first
+            # match is the first entry parse_field would have matched
+            pairs = next((p for n, p in self.info_map.items() 
+                if n.find(name) > -1), None)
+
+        if (pairs is None):
+            return '.'
+        return str(pairs[1])
+
+    """Appends text to INFO as it is
+    """
+    def appendInfo(self, text):
+        if (text != ''):
+            self.info.append(text)
+            self.info_map = None
+
+    """Appends text to INFO as an entry of its own, after a ';' unless INFO
+       already ends with one
+    """
+    def addInfo(self, text):
+        if self.info[-1].endswith(';'):
+            self.appendInfo(text)
+        else:
+            self.appendInfo(';' + text)
 
-    inds = getFormatSpecificIndices(format=format)
+    """Prefixes every field but the first with pad
+    """
+    def padFields(self, pad):
+        self.fields[1:] = [pad + f for f in self.fields[1:]]
+        if (self.info is not None):
+            self.info[0] = pad + self.info[0]
+            self.info_map = None
 
-    fh = open(vcf)
+    """Tells whether the last field is empty or ends in whitespace
+    """
+    def endsInSpace(self):
+        last = self.info[-1] if (len(self.fields) == 8) else self.fields[-1]
+        return (last == '') or last[-1].isspace()
+
+    def getFields(self):
+        if (self.info is not None):
+            self.fields[7] = self.getInfo()
+        return self.fields
+
+    def getLine(self):
+        return '\t'.join(self.getFields())
+
+
+"""Header test used by dbSNP, BigRefGene and gene annotation
+"""
+def isCommentLine(line):
+    return line.startswith("#")
+
+
+"""Header test used by the overlap annotators
+"""
+def isHeaderLine(line):
+    return (line.startswith("##") or line.startswith('CHROM') or 
+        line.startswith('#CHROM'))
+
+
+"""Runs a per-record annotator over every data line of a VCF file
+   With a prefetch function and batch_size, records are read in chunks of
+   batch_size and each chunk is resolved up front by prefetch, whose result 
+   is handed to the annotator as lookup
+   Returns the counters the annotator collected
+"""
+def annotateVcfFile(infile, outfile, annotate, isHeader, format='vcf', 
+    sep='\t', prefetch=None, batch_size=None, exact_info=False, **kwargs):
+
+    counts = Counter()
+    inds = getFormatSpecificIndices(format=format)
+    fh_out = open(outfile, "w")
+    fh = open(infile)
     conn = u.db_connect()
     cursor = conn.cursor()
-    linenum = 1
 
-    for line in fh:
-        line = line.strip()
-        if not line.startswith("#"):
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            if chr.startswith("chr"):
-                chr = chr.replace('chr', '')
+    if (prefetch is None):
+        batch_size = None
 
-            pos = fields[inds[1]].strip()
-            ref = clean_mysql_chars(fields[inds[2]]).strip()
-            alt = clean_mysql_chars(fields[inds[3]]).strip()
+    for lines in fu.readChunks(fh, batch_size or 1):
+        chunk = []
+        for line in lines:
+            if isHeader(line):
+                chunk.append(line)
+            else:
+                chunk.append(VariantRecord(line.split(sep), inds, exact_info))
 
-            compRef = getComplementary(ref)
-            compAlt = getComplementary(alt)
+        lookup = None
+        if (batch_size is not None):
+            lookup = prefetch(cursor, [record for record in chunk 
+                if isinstance(record, VariantRecord)], **kwargs)
 
-            sql = 'select * from dbSNP where CHR="' + str(chr) + \
-                '" AND POS=' + str(pos) + ' AND ( REF="' + str(ref) + \
-                '" OR REF ="' + str(compRef) + '" )  AND INFO = "' + \
-                varclass + '" ;'
-            cursor.execute(sql)
-            rows = cursor.fetchall()
+        for record in chunk:
+            if not isinstance(record, VariantRecord):
+                fh_out.write(record + '\n')
+            else:
+                if (lookup is not None):
+                    annotate(cursor, record, counts, lookup=lookup, **kwargs)
+                else:
+                    annotate(cursor, record, counts, **kwargs)
+                fh_out.write(record.getLine() + '\n')
 
-            fields[2] = '.'
-            rsids = []
-            mafs = []
-            if (len(rows) > 0):
-                for row in rows:
-                    rsids.append(str(row[3]))
-                    if (str(row[7]) != '.'):
-                        mafs.append('GMAF=' + str(row[7]))
+    conn.close()
+    fh.close()
+    fh_out.close()
 
-                maf_str=''
-                if (len(mafs) > 0):
-                    maf_str = ';' + ';'.join([str(x) for x in mafs])
+    return counts
 
-                var_count = var_count + 1
-                if (str(fields[7]) == '.'):
-                    fields[7] = 'DB' + maf_str
-                else:
-                    fields[7] = fields[7] + ';DB;VC=' + varclass + maf_str
 
-                fields[2] = str(';'.join(rsids))
-                l = '\t'.join([str(x) for x in fields])
-                fh_out.write(l + '\n')
+"""UCSC standard binning scheme: five levels of bins from 128kb up to 512Mb,
+   each bin eight times the size of the ones below it, offsets finest first
+"""
+BIN_OFFSETS = [512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_MAX_END = 1 << 29
+
 
-            else:
-                ## reset rsid to "." - in case there was annotation from old release of dbSNP
-                fh_out.write('\t'.join([str(x) for x in fields]) + '\n')
+"""Every bin a feature overlapping the half-open range [start, end) can be
+   filed in, or None past the range the standard scheme covers
+"""
+def getBins(start, end):
+    start = max(0, int(start))
+    end = max(start + 1, int(end))
+    if (end > BIN_MAX_END):
+        return None
+
+    bins = []
+    startBin = start >> BIN_FIRST_SHIFT
+    endBin = (end - 1) >> BIN_FIRST_SHIFT
+    for offset in BIN_OFFSETS:
+        bins.extend(range(offset + startBin, offset + endBin + 1))
+        startBin = startBin >> BIN_NEXT_SHIFT
+        endBin = endBin >> BIN_NEXT_SHIFT
+    return bins
+
+
+"""SQL restricting a query on a UCSC table to the bins of features that can
+   overlap [start, end), or '' when table is not in binned_tables
+   A closed chromStart <= pos <= chromEnd test needs [pos - 1, pos + 1): UCSC
+   ends are exclusive, so a feature ending at pos lies in pos - 1's bins
+"""
+def getBinClause(table, start, end, binned_tables=()):
+    if (table not in binned_tables):
+        return ''
+    bins = getBins(start, end)
+    if (bins is None):
+        return ''
+    return ' AND bin IN (' + ','.join([str(b) for b in bins]) + ')'
 
-            linenum = linenum + 1
 
+"""Session temporary table the positions of a chunk are bulk-loaded into
+   for OverlapJoin
+"""
+JOIN_POSITIONS_DDL = 'create temporary table if not exists ann_positions ' + \
+    '(line_no int not null, chr varchar(64) not null, ' + \
+    'chrom varchar(64) not null, pos bigint not null, key (chr, pos), ' + \
+    'key (chrom, pos));'
+
+# Rows per multi-row insert into ann_positions
+JOIN_INSERT_SIZE = 1000
+
+
+"""Replaces the positions in ann_positions with those of a chunk of records
+   Each distinct position is loaded once, numbered in the order it first
+   appears in the chunk
+"""
+def loadJoinPositions(cursor, records):
+    positions = []
+    seen = set()
+    for record in records:
+        position = (record.chr, record.chrom, int(record.pos))
+        if position not in seen:
+            seen.add(position)
+            positions.append(position)
+
+    cursor.execute(JOIN_POSITIONS_DDL)
+    cursor.execute('delete from ann_positions;')
+    for i in range(0, len(positions), JOIN_INSERT_SIZE):
+        values = []
+        for n, (chr, chrom, pos) in enumerate(positions[i:i + JOIN_INSERT_SIZE]):
+            values.append('(' + str(i + n) + ',"' + chr + '","' + chrom + \
+                '",' + str(pos) + ')')
+        cursor.execute('insert into ann_positions values ' + 
+            ','.join(values) + ';')
+
+
+"""Loads every OverlapJoin of joins with the positions of a chunk of records
+   ann_positions lives in the server session, so when the cursor had to
+   reconnect on the way it is loaded again and the joins rerun, once
+"""
+def loadJoins(cursor, records, joins):
+    for attempt in range(2):
+        session = cursor.session
+        try:
+            loadJoinPositions(cursor, records)
+            for join in joins:
+                join.load(cursor)
+        except Exception:
+            # Other errors are not the reconnect's doing
+            if (cursor.session == session):
+                raise
+        if (cursor.session == session):
+            return
+
+    raise RuntimeError('Lost the database session twice while joining a ' +
+        'chunk of records')
+
+
+"""Overlaps of a chunk of records with table, resolved on the server by one
+   range join against the positions loadJoinPositions put in ann_positions
+   and gathered by position; for tables too large to hold in an interval
+   index. Answers find and first like an IntervalIndex
+   The hits of one position are sorted in storage order, by bin and
+   interval (interval_index.getStorageKey), like those of the index
+   key is the record key ('chrom' or 'chr') matched against the chrom column
+"""
+class OverlapJoin(object):
+    def __init__(self, table, key='chrom', chrom='chrom', start='chromStart',
+        end='chromEnd'):
+
+        self.table = table
+        self.start = start
+        self.end = end
+        self.sql = 'select p.line_no, p.' + key + ', p.pos, t.* from ' + \
+            'ann_positions p join ' + table + ' t on t.' + chrom + ' = p.' + \
+            key + ' and t.' + start + ' <= p.pos and p.pos <= t.' + end + ';'
+        self.rows = {}
+        self.columns = []
+
+    """Runs the join for the positions currently in ann_positions
+    """
+    def load(self, cursor):
+        self.rows = {}
+        cursor.execute(self.sql)
+        self.columns = [str(c[0]) for c in cursor.description[3:]]
+        for row in cursor.fetchall():
+            self.rows.setdefault((str(row[1]).upper(), int(row[2])), 
+                []).append(row[3:])
+        key = ii.getStorageKey(self.columns, self.start, self.end)
+        for rows in self.rows.values():
+            rows.sort(key=key)
+
+    def find(self, chrom, pos):
+        return self.rows.get((str(chrom).upper(), int(pos)), [])
+
+    def first(self, chrom, pos):
+        rows = self.find(chrom, pos)
+        if (len(rows) > 0):
+            return rows[0]
+        return None
+
+    def column(self, name):
+        return [c.lower() for c in self.columns].index(name.lower())
+
+
+"""Appends the overlap counters of one table to the count log
+"""
+def writeOverlapLog(fh_log, counts, table, **kwargs):
+    fh_log.write(f"In {str(table)}: {str(counts['var'])} in " + \
+        f"{str(counts['line'])} variants\n")
+
+
+""""Format must be pileup or vcf
+    Types of variants in dbSNP135: DIV, SNV, MNV, MIXED
+    With batch_size, variants are looked up batch_size at a time
+""" 
+def getSnpsFromDbSnp(vcf, format='vcf', tmpextin='', tmpextout='.1',
+    varclass='SNV', sep='\t', batch_size=None):
+
+    counts = annotateVcfFile(vcf, vcf + tmpextout, dbSnpRecord, 
+        isCommentLine, format=format, sep=sep, prefetch=getDbSnpBatch, 
+        batch_size=batch_size, varclass=varclass)
+
+    fh_log = open(vcf + '.count.log', 'w')
+    writeDbSnpLog(fh_log, counts)
+    fh_log.close()
+
+
+"""Tells whether a record may be in dbSNP under its REF or complementary
+   REF: always, without a Bloom filter of dbSNP to rule it out
+"""
+def mayBeInDbSnp(record, bloom=None):
+    if (bloom is None) or not record.pos.isdigit():
+        return True
+    return (bf.getDbSnpKey(record.chr, record.pos, record.ref) in bloom) or \
+        (bf.getDbSnpKey(record.chr, record.pos, 
+        getComplementary(record.ref)) in bloom)
+
+
+"""Fetches the dbSNP rows of a chunk of records, one query per chromosome
+   Rows are keyed by (CHR, POS) and carry CHR, POS and REF in front of the
+   dbSNP columns, for dbSnpRecord to match REF against
+   Records the Bloom filter rules out are not fetched
+"""
+def getDbSnpBatch(cursor, records, varclass='SNV', bloom=None, **kwargs):
+    positions = {}
+    for record in records:
+        if mayBeInDbSnp(record, bloom):
+            positions.setdefault(record.chr, set()).add(int(record.pos))
+
+    lookup = {}
+    for chr in positions:
+        sql = 'select CHR, POS, REF, dbSNP.* from dbSNP where CHR="' + \
+            chr + '" AND POS IN (' + \
+            ','.join([str(x) for x in sorted(positions[chr])]) + \
+            ') AND INFO = "' + varclass + '" ;'
+        cursor.execute(sql)
+        for row in cursor.fetchall():
+            lookup.setdefault((str(row[0]).upper(), int(row[1])), []).append(row)
+
+    return lookup
+
+
+"""Looks up one record in dbSNP; sets its rsIDs and flags it in INFO
+   lookup is a chunk fetched by getDbSnpBatch, otherwise dbSNP is queried
+   unless bloom, a Bloom filter of dbSNP, rules the record out
+"""
+def dbSnpRecord(cursor, record, counts, varclass='SNV', lookup=None,
+    bloom=None):
+    ref = record.ref
+    compRef = getComplementary(ref)
+
+    if (lookup is None) and not mayBeInDbSnp(record, bloom):
+        rows = []
+    elif (lookup is None):
+        sql = 'select * from dbSNP where CHR="' + str(record.chr) + \
+            '" AND POS=' + str(record.pos) + ' AND ( REF="' + str(ref) + \
+            '" OR REF ="' + str(compRef) + '" )  AND INFO = "' + \
+            varclass + '" ;'
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+    else:
+        # MySQL compares strings case-insensitively
+        refs = (ref.upper(), compRef.upper())
+        rows = [row[3:] for row in 
+            lookup.get((record.chrom_key, int(record.pos)), []) 
+            if str(row[2]).upper() in refs]
+
+    ## reset rsid to "." - in case there was annotation from old release of dbSNP
+    record.fields[2] = '.'
+    counts['records'] = counts['records'] + 1
+
+    if (len(rows) > 0):
+        rsids = []
+        mafs = []
+        for row in rows:
+            rsids.append(str(row[3]))
+            if (str(row[7]) != '.'):
+                mafs.append('GMAF=' + str(row[7]))
+
+        maf_str=''
+        if (len(mafs) > 0):
+            maf_str = ';' + ';'.join([str(x) for x in mafs])
+
+        counts['var'] = counts['var'] + 1
+        if (record.getInfo() == '.'):
+            record.setInfo('DB' + maf_str)
         else:
-            fh_out.write(line + '\n')
+            record.appendInfo(';DB;VC=' + varclass + maf_str)
+
+        record.fields[2] = str(';'.join(rsids))
 
-    ratioInDbSnp = (var_count / float(linenum)) * 100
+
+def writeDbSnpLog(fh_log, counts, **kwargs):
+    # Variants were always counted from 1, keep it so totals stay comparable
+    linenum = counts['records'] + 1
+    ratioInDbSnp = (counts['var'] / float(linenum)) * 100
     fh_log.write("## Please notice that all Isoforms were counted\n")
     fh_log.write("## Numbers may exceed number of variants in the annotated file\n")
     fh_log.write(f"Total: {str(linenum)}\n")
-    fh_log.write(f"In dbSNP: {str(var_count)} ({str(ratioInDbSnp)}%)\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
+    fh_log.write(f"In dbSNP: {str(counts['var'])} ({str(ratioInDbSnp)}%)\n")
 
 
 """NOTE: all isoforms are collapsed in one record
@@ -198,115 +607,213 @@ def getSnpsFromDbSnp(vcf, format='vcf', tmpextin='', tmpextout='.1',
     3. chrom_pos_unequal
 """
 def getBigRefGene(vcf, format='vcf', tmpextin='.1', tmpextout='.2', sep='\t'):
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-    fh_out = open(outfile, "w")
-    inds = getFormatSpecificIndices(format=format)
-    fh = open(vcf)
+    annotateVcfFile(vcf + tmpextin, vcf + tmpextout, bigRefGeneRecord, 
+        isCommentLine, format=format, sep=sep)
 
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    vcf_linenum = 1
 
-    for line in fh:
-        line = line.strip()
-        if not line.startswith("#"):
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            if chr.startswith("chr"):
-                chr = chr.replace('chr', '')
+"""The first of the three tables with a hit annotates the record
+   With index, all three are resolved by one probe of the BigRefGeneIndex
+"""
+def bigRefGeneRecord(cursor, record, counts, index=None):
+    chr = record.chr
+    pos = record.pos
+    ref = record.ref
+    alt = record.alt
 
-            pos = fields[inds[1]].strip()
-            ref = clean_mysql_chars(fields[inds[2]]).strip()
-            alt = clean_mysql_chars(fields[inds[3]]).strip()
+    compRef = getComplementary(ref)
+    compAlt = getComplementary(alt)
 
-            compRef = getComplementary(ref)
-            compAlt = getComplementary(alt)
+    if (index is not None):
+        rows = index.resolve(chr, pos, [(ref, alt), (compRef, compAlt)])
+        if (len(rows) > 0):
+            writeBigRefGeneRows(record, rows)
+        return
 
-            sql1 = 'select * from chrom_pos_equal_base where CHR="' + \
-                str(chr) + '" AND start = ' + str(pos) + \
-                ' AND ((haplotypeReference="' + str(ref) + \
-                '" AND haplotypeAlternate ="' + str(alt) + \
-                '") OR (haplotypeReference="' + str(compRef) + \
-                '" AND haplotypeAlternate ="' + str(compAlt) + '"));'
+    sql1 = 'select * from chrom_pos_equal_base where CHR="' + \
+        str(chr) + '" AND start = ' + str(pos) + \
+        ' AND ((haplotypeReference="' + str(ref) + \
+        '" AND haplotypeAlternate ="' + str(alt) + \
+        '") OR (haplotypeReference="' + str(compRef) + \
+        '" AND haplotypeAlternate ="' + str(compAlt) + '"));'
 
-            sql2 = 'select * from chrom_pos_equal_nobase where CHR="' + \
-                str(chr) + '" AND start = ' + str(pos) + ';'
+    sql2 = 'select * from chrom_pos_equal_nobase where CHR="' + \
+        str(chr) + '" AND start = ' + str(pos) + ';'
 
-            sql3 = 'select * from chrom_pos_unequal where CHR="' + \
-                str(chr) + '" AND start <= ' + str(pos) + ' AND ' + \
-                str(pos) + ' <= end ;'
+    sql3 = 'select * from chrom_pos_unequal where CHR="' + \
+        str(chr) + '" AND start <= ' + str(pos) + ' AND ' + \
+        str(pos) + ' <= end ;'
 
-            keep_going = True
-            cursor.execute(sql1)
-            rows = cursor.fetchall()
+    for sql in (sql1, sql2, sql3):
+        cursor.execute(sql)
+        rows = cursor.fetchall()
 
-            if (len(rows) > 0):
-                keep_going = False
-                m = set([])
-                for row in rows:
-                    m.add(collapseRefSeq('\t'.join([str(x) for x in row[1:len(row)] ])))
+        if (len(rows) > 0):
+            writeBigRefGeneRows(record, rows)
+            return
 
-                fields[7] = fields[7] + ';' + ';'.join(m)
-                if (str(fields[7]).startswith(".;")):
-                    fields[7] = str(fields[7]).replace('.;', '', 1)
 
-                l = '\t'.join([str(x) for x in fields])
-                fh_out.write(l + '\n')
+"""Appends the collapsed bigRefGene rows to the INFO field
+"""
+def writeBigRefGeneRows(record, rows):
+    m = set([])
+    for row in rows:
+        m.add(collapseRefSeq('\t'.join([str(x) for x in row[1:len(row)]])))
 
-            if (keep_going):
-                cursor.execute(sql2)
-                rows = cursor.fetchall()
+    record.appendInfo(';' + ';'.join(m))
+    if record.getInfo().startswith(".;"):
+        record.setInfo(record.getInfo().replace('.;', '', 1))
 
-                if (len(rows) > 0):
-                    keep_going = False
-                    m = set([])
-                    for row in rows:
-                        m.add(collapseRefSeq('\t'.join([str(x) for x in row[1:len(row)]])))
 
-                    fields[7] = fields[7] + ';' + ';'.join(m)
-                    if (str(fields[7]).startswith(".;")):
-                        fields[7] = str(fields[7]).replace('.;', '', 1)
-                    
-                    l = '\t'.join([str(x) for x in fields])
-                    fh_out.write(l + '\n')
+"""Get information about location in gene structures
+"""
+def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500, 
+    tmpextin='.2', tmpextout='.3', sep='\t'):
 
-            if (keep_going):
-                cursor.execute(sql3)
-                rows = cursor.fetchall()
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, genesRecord, 
+        isCommentLine, format=format, sep=sep, table=table, 
+        promoter_offset=promoter_offset)
 
-                if (len(rows) > 0):
-                    keep_going = False
-                    m = set([])
-                    for row in rows:
-                        m.add(collapseRefSeq('\t'.join([str(x) for x in row[1:len(row)]])))
+    fh_log = open(vcf + '.count.log', 'a')
+    writeGenesLog(fh_log, counts)
+    fh_log.close()
 
-                    fields[7] = fields[7] + ';' + ';'.join(m)
-                    if (str(fields[7]).startswith(".;")):
-                        fields[7] = str(fields[7]).replace('.;', '', 1)
 
-                    l = '\t'.join([str(x) for x in fields])
-                    fh_out.write(l + '\n')
+"""Query of the genes of table whose transcript, widened by promoter_offset
+   on both sides, holds pos on chr
+"""
+def getGenesQuery(chr, pos, table='refGene', promoter_offset=500, 
+    binned_tables=()):
+    return 'select * from ' + table + ' where chrom="' + str(chr) + '"' + \
+        getBinClause(table, int(pos) - promoter_offset - 1, 
+        int(pos) + promoter_offset + 1, binned_tables) + \
+        ' AND (txStart - ' + str(promoter_offset) +') <= ' + \
+        str(pos) + ' AND ' + str(pos) + ' <= (txEnd + ' + \
+        str(promoter_offset) +');'
+
+
+"""Locates one record in the gene structures of table
+   CpG islands for putative promoters come from cpg_index when given
+"""
+def genesRecord(cursor, record, counts, table='refGene', 
+    promoter_offset=500, cpg_index=None, binned_tables=()):
+
+    chr = record.chrom
+    pos = record.pos
+
+    sql = getGenesQuery(chr, pos, table, promoter_offset, binned_tables)
+
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    info = []
+
+    if (len(rows) > 0):
+        positionType = record.getInfoField('positionType')
+        pos = int(pos)
+
+        cnt = 1
+        for row in rows:
+            #count location
+            if (positionType == 'intron'):
+                counts['intronic'] = counts['intronic'] + 1
+            elif (positionType == 'non_coding_intron'):
+                counts['non_coding_intronic'] = counts['non_coding_intronic'] + 1
+            elif (positionType == 'CDS'):
+                counts['cds'] = counts['cds'] + 1
+            elif (positionType == 'non_coding_exon'):
+                counts['non_coding_exonic'] = counts['non_coding_exonic'] + 1
+            elif (positionType == 'utr5'):
+                counts['utr5'] = counts['utr5'] + 1
+            elif (positionType == 'utr3'):
+                counts['utr3'] = counts['utr3'] + 1
+
+            txtStart = int(row[4])
+            txtEnd = int(row[5])
+            cdsStart = int(row[6])
+            cdsEnd = int(row[7])
+            exonCount = int(row[8])
+            strand = str(row[3])
+
+            promoter_plus = txtStart - int(promoter_offset)
+            promoter_minus = txtEnd + int(promoter_offset)
+            region = ""
+            exons = []
+
+            if (cdsStart == cdsEnd):
+                for e in findExons(getTranscriptExons(row, exonCount), pos):
+                    exnum = e + 1
+                    if (strand == '-'):
+                        exnum = exonCount - e
+                    exons.append("non_coding_exon=" + "ex" + \
+                        str(exnum) + '/' + str(exonCount))
+                if (len(exons) > 0):
+                    region = ";".join(exons)
+            elif (u.isBetween(pos, cdsStart, cdsEnd)):
+                for e in findExons(getTranscriptExons(row, exonCount), pos):
+                    exnum = e + 1
+                    if (strand == '-'):
+                        exnum = exonCount - e
+                    exons.append("exon=" +  "ex" + \
+                        str(exnum) + '/' + str(exonCount))
+                    counts['exonic'] = counts['exonic'] + 1
+                if (len(exons) > 0):
+                    region = ";".join(exons)
+
+            elif ((u.isBetween(pos, promoter_plus, txtStart) and 
+                (strand == "+")) or 
+                (u.isBetween(pos, txtEnd, promoter_minus) and (strand == "-"))):
+                if (cpg_index is not None):
+                    cpg = cpg_index.first(chr, pos)
+                    name_ind = cpg_index.column('name')
+                else:
+                    sql = 'select chrom, chromStart, chromEnd, name from ' + \
+                        'cpgIslandExt where chrom="' + str(chr) + '"' + \
+                        getBinClause('cpgIslandExt', pos - 1, pos + 1, 
+                        binned_tables) + ' AND (chromStart <= ' + str(pos) + \
+                        ' AND ' + str(pos) + ' <= chromEnd);'
+                    cursor.execute(sql)
+                    cpg = cursor.fetchone()
+                    name_ind = 3
 
-            if (keep_going):
-                fh_out.write(line + '\n')
+                if (cpg is not None):
+                    region = 'putativePromoterRegion=' + \
+                        "".join(str(cpg[name_ind]).split())
+                    counts['promoter'] = counts['promoter'] + 1
 
-            vcf_linenum = vcf_linenum + 1
+            if (region != ''):
+                info.append(collapseGeneNames(row=row, 
+                    indices=indicesKnownGenes, region=region, cnt=cnt))
 
-        else:
-            fh_out.write(line + '\n')
+            cnt = cnt + 1
 
-    conn.close()
-    fh.close()
-    fh_out.close()
+        record.appendInfo(';' + ";".join(info))
+
+    else:
+        record.appendInfo(";positionType=interGenic")
+        counts['interGenic'] = counts['interGenic'] + 1
 
 
-"""Get information about location in gene structures
+def writeGenesLog(fh_log, counts, **kwargs):
+    lines = ["Variants located:",
+        f"In interGenic {str(counts['interGenic'])}",
+        f"In CDS {str(counts['cds'])}",
+        f"In \'3 UTR {str(counts['utr3'])}",
+        f"In \'5 UTR {str(counts['utr5'])}",
+        f"In Intronic {str(counts['intronic'])}",
+        f"In Non_coding_intronic {str(counts['non_coding_intronic'])}",
+        f"In Exonic {str(counts['exonic'])}",
+        f"In Non_coding_exonic {str(counts['non_coding_exonic'])}",
+        f"In Putative Promoter Region {str(counts['promoter'])}"]
+
+    for line in lines:
+        print(line)
+        fh_log.write(line + '\n')
+
+
+"""Method used in INDELS, where bigRefGeneTable is not applicable
 """
-def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500, 
+def getExonsEtAl(vcf, format='vcf', table='refGene', promoter_offset=500, 
     tmpextin='.2', tmpextout='.3', sep='\t'):
-    
+
     basefile = vcf
     vcf = basefile + tmpextin
     outfile = basefile + tmpextout
@@ -336,10 +843,10 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
         if not line.startswith("#"):
             fields = line.split(sep)
             chr = fields[inds[0]].strip()
-
+            
             if not chr.startswith("chr"):
                 chr = "chr" + chr
-
+            
             pos = fields[inds[1]].strip()
             ref = clean_mysql_chars(fields[inds[2]]).strip()
             alt = clean_mysql_chars(fields[inds[3]]).strip()
@@ -347,41 +854,22 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
             this_gene_name = str(u.parse_field(info_field, 'name', ';', '='))
 
             sql = 'select * from ' + table + ' where chrom="' + str(chr) + \
-                '" AND (txStart - ' + str(promoter_offset) +') <= ' + \
+                '"   AND (txStart - ' + str(promoter_offset) + ') <= ' + \
                 str(pos) + ' AND ' + str(pos) + ' <= (txEnd + ' + \
                 str(promoter_offset) +');'
-
             cursor.execute(sql)
             rows = cursor.fetchall()
             info = []
-
             if (len(rows) > 0):
                 cnt = 1
                 for row in rows:
-                    #count location
-                    positionType = str(u.parse_field(info_field, 
-                        'positionType', ';', '='))
-                    
-                    if (positionType == 'intron'):
-                        intronic_count = intronic_count + 1
-                    elif (positionType == 'non_coding_intron'):
-                        non_coding_intronic_count = non_coding_intronic_count + 1
-                    elif (positionType == 'CDS'):
-                        cds_count = cds_count + 1
-                    elif (positionType == 'non_coding_exon'):
-                        non_coding_exonic_count = non_coding_exonic_count + 1
-                    elif (positionType == 'utr5'):
-                        utr5_count = utr5_count + 1
-                    elif (positionType == 'utr3'):
-                        utr3_count = utr3_count + 1
-
                     txtStart = int(row[4])
                     txtEnd = int(row[5])
                     cdsStart = int(row[6])
                     cdsEnd = int(row[7])
                     exonCount = int(row[8])
-                    exonStarts =str(row[9].decode("utf-8"))
-                    exonEnds = str(row[10].decode("utf-8"))
+                    exonStarts =str(row[9].decode('utf-8'))
+                    exonEnds = str(row[10].decode('utf-8'))
                     geneSymbol = str(row[12])
                     strand = str(row[3])
 
@@ -398,29 +886,58 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
                             if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
                                 exnum = e + 1
                                 if (strand == '-'):
-                                    exnum = exonCount - e
+                                    exnum =  exonCount - e
                                 exons.append("non_coding_exon=" + "ex" + \
                                     str(exnum) + '/' + str(exonCount))
+                                non_coding_exonic_count = non_coding_exonic_count + 1
                         if (len(exons) > 0):
-                            region = ";".join(exons)
-                    elif (u.isBetween(pos, cdsStart, cdsEnd)):
+                            region='positionType=non_coding_exon;' + ";".join(exons)
+                        else:
+                            non_coding_intronic_count = non_coding_intronic_count + 1
+                            region = 'positionType=non_coding_intron'
+
+                    elif (u.isBetween(pos, cdsStart, cdsEnd) and (cdsStart < cdsEnd)):
+                        cds_count = cds_count + 1
                         for e in range(0, exonCount):
-                            if u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e])):
+                            if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
                                 exnum = e + 1
                                 if (strand == '-'):
-                                    exnum = exonCount - e
-                                exons.append("exon=" +  "ex" + \
+                                    exnum =  exonCount - e
+                                exons.append("exon=" + "ex" + \
                                     str(exnum) + '/' + str(exonCount))
-                                exonic_count = exonic_count + 1
+                                exonic_count=exonic_count+1
                         if (len(exons) > 0):
-                            region = ";".join(exons)
+                            region = 'positionType=CDS;' + ";".join(exons)
+                        else:
+                            intronic_count = intronic_count + 1
+                            region = 'positionType=CDS;' + 'intron'
+
+                    elif (u.isBetween(pos, txtStart, cdsStart) and \
+                        (cdsStart < cdsEnd) and (strand == "+")):
+                        utr5_count = utr5_count + 1
+                        region = 'positionType=utr5'
+
+                    elif (u.isBetween(pos, cdsEnd, txtEnd) and \
+                        (cdsStart < cdsEnd) (strand == "+")):
+                        utr3_count = utr3_count + 1
+                        region = 'positionType=utr3'
+
+                    elif (u.isBetween(pos, cdsEnd, txtEnd) and 
+                        (cdsStart < cdsEnd) (strand == "-")):
+                        utr5_count = utr5_count + 1
+                        region = 'positionType=utr5'
+
+                    elif (u.isBetween(pos, txtStart, cdsStart) and \
+                        (cdsStart < cdsEnd) and (strand == "-")):
+                        utr3_count = utr3_count + 1
+                        region = 'positionType=utr3'
 
-                    elif (u.isBetween(pos, promoter_plus, txtStart) and 
+                    elif (u.isBetween(pos, promoter_plus, txtStart) and \
                         (strand == "+")):
-                        sql = 'select chrom, chromStart, chromEnd, name from ' + \
-                            'cpgIslandExt where chrom="' + str(chr) + \
-                            '" AND (chromStart <= ' + str(pos) + \
-                            ' AND ' + str(pos) + ' <= chromEnd);'
+                        sql = 'select chrom, chromStart, chromEnd, name ' + \
+                            'from cpgIslandExt where chrom="' + str(chr) +  \
+                            '" AND (chromStart <= ' + str(pos) + ' AND ' + \
+                            str(pos) + ' <= chromEnd);'
                         cursor.execute(sql)
                         rows = cursor.fetchone()
 
@@ -429,25 +946,27 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
                                 "".join(str(rows[3]).split())
                             promoter_count = promoter_count + 1
 
-                    elif (u.isBetween(pos, txtEnd, promoter_minus) and (strand == "-")):
-                        sql = 'select chrom, chromStart, chromEnd, name from ' + \
-                            'cpgIslandExt where chrom="' + str(chr) + \
-                            '" AND (chromStart <= ' + str(pos) + \
-                            ' AND ' + str(pos) + ' <= chromEnd);'
+                    elif (u.isBetween(pos, txtEnd, promoter_minus) and \
+                        (strand == "-")):
+                        sql = 'select chrom, chromStart, chromEnd, name ' + \
+                            'from cpgIslandExt where chrom="' + str(chr) + \
+                            '" AND (chromStart <= ' + str(pos) + ' AND ' + \
+                            str(pos) + ' <= chromEnd);'
                         cursor.execute(sql)
-
                         rows = cursor.fetchone()
+
                         if (rows is not None):
-                            region = 'putativePromoterRegion=' +  \
-                                "".join(str(rows[3]).split())
+                            region = 'putativePromoterRegion=' + \
+                            "".join(str(rows[3]).split())
                             promoter_count = promoter_count + 1
 
                     else:
                         region = ''
 
                     if (region != ''):
-                        info.append(collapseGeneNames(row=row, 
-                            indices=indicesKnownGenes, region=region, cnt=cnt))
+                        info.append(collapseGeneNames(
+                            row=row, indices=indicesKnownGenes, 
+                            region=region, cnt=cnt))
 
                     cnt = cnt + 1
 
@@ -481,7 +1000,7 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
     fh_log.write(f"In \'5 UTR {str(utr5_count)}\n")
 
     print(f"In Intronic {str(intronic_count)}")
-    fh_log.write(f"In Intronic {str(intronic_count)}\n")
+    fh_log.write(f"In Intronic "+str(intronic_count) +'\n')
 
     print(f"In Non_coding_intronic {str(non_coding_intronic_count)}")
     fh_log.write(f"In Non_coding_intronic {str(non_coding_intronic_count)}\n")
@@ -501,612 +1020,74 @@ def getGenes(vcf, format='vcf', table='refGene', promoter_offset=500,
     conn.close()
 
 
-"""Method used in INDELS, where bigRefGeneTable is not applicable
+"""Overlap with tfbsConsSites
 """
-def getExonsEtAl(vcf, format='vcf', table='refGene', promoter_offset=500, 
+def addOverlapWithTfbsConsSites(vcf, format='vcf', table='tfbsConsSites', 
     tmpextin='.2', tmpextout='.3', sep='\t'):
 
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-    fh_out = open(outfile, "w")
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, 
+        spec=TFBS_OVERLAP)
 
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
+    fh_log = open(vcf + '.count.log', 'a')
+    writeOverlapLog(fh_log, counts, table)
+    fh_log.close()
 
-    interGenic_count = 0
-    cds_count = 0
-    utr3_count = 0
-    utr5_count = 0
-    intronic_count = 0
-    non_coding_intronic_count = 0
-    exonic_count = 0
-    non_coding_exonic_count = 0
-    promoter_count = 0
 
-    inds = getFormatSpecificIndices(format=format)
-    fh = open(vcf)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
+"""Overlap with GadAll table
+"""
+def addOverlapWithGadAll(vcf, format='vcf', table='gadAll', tmpextin='', 
+    tmpextout='.1', sep='\t'):
 
-    for line in fh:
-        line = line.strip()
-        if not line.startswith("#"):
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            
-            if not chr.startswith("chr"):
-                chr = "chr" + chr
-            
-            pos = fields[inds[1]].strip()
-            ref = clean_mysql_chars(fields[inds[2]]).strip()
-            alt = clean_mysql_chars(fields[inds[3]]).strip()
-            info_field = clean_mysql_chars(fields[7]).strip()
-            this_gene_name = str(u.parse_field(info_field, 'name', ';', '='))
-
-            sql = 'select * from ' + table + ' where chrom="' + str(chr) + \
-                '"   AND (txStart - ' + str(promoter_offset) + ') <= ' + \
-                str(pos) + ' AND ' + str(pos) + ' <= (txEnd + ' + \
-                str(promoter_offset) +');'
-            cursor.execute(sql)
-            rows = cursor.fetchall()
-            info = []
-            if (len(rows) > 0):
-                cnt = 1
-                for row in rows:
-                    txtStart = int(row[4])
-                    txtEnd = int(row[5])
-                    cdsStart = int(row[6])
-                    cdsEnd = int(row[7])
-                    exonCount = int(row[8])
-                    exonStarts =str(row[9].decode('utf-8'))
-                    exonEnds = str(row[10].decode('utf-8'))
-                    geneSymbol = str(row[12])
-                    strand = str(row[3])
-
-                    promoter_plus = txtStart - int(promoter_offset)
-                    promoter_minus = txtEnd + int(promoter_offset)
-                    region = ""
-                    pos = int(pos)
-                    exons = []
-                    exonsSt = exonStarts.split(',')
-                    exonsEn = exonEnds.split(',')
-
-                    if (cdsStart == cdsEnd):
-                        for e in range(0, exonCount):
-                            if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
-                                exnum = e + 1
-                                if (strand == '-'):
-                                    exnum =  exonCount - e
-                                exons.append("non_coding_exon=" + "ex" + \
-                                    str(exnum) + '/' + str(exonCount))
-                                non_coding_exonic_count = non_coding_exonic_count + 1
-                        if (len(exons) > 0):
-                            region='positionType=non_coding_exon;' + ";".join(exons)
-                        else:
-                            non_coding_intronic_count = non_coding_intronic_count + 1
-                            region = 'positionType=non_coding_intron'
-
-                    elif (u.isBetween(pos, cdsStart, cdsEnd) and (cdsStart < cdsEnd)):
-                        cds_count = cds_count + 1
-                        for e in range(0, exonCount):
-                            if (u.isBetween(pos, int(exonsSt[e]), int(exonsEn[e]))):
-                                exnum = e + 1
-                                if (strand == '-'):
-                                    exnum =  exonCount - e
-                                exons.append("exon=" + "ex" + \
-                                    str(exnum) + '/' + str(exonCount))
-                                exonic_count=exonic_count+1
-                        if (len(exons) > 0):
-                            region = 'positionType=CDS;' + ";".join(exons)
-                        else:
-                            intronic_count = intronic_count + 1
-                            region = 'positionType=CDS;' + 'intron'
-
-                    elif (u.isBetween(pos, txtStart, cdsStart) and \
-                        (cdsStart < cdsEnd) and (strand == "+")):
-                        utr5_count = utr5_count + 1
-                        region = 'positionType=utr5'
-
-                    elif (u.isBetween(pos, cdsEnd, txtEnd) and \
-                        (cdsStart < cdsEnd) (strand == "+")):
-                        utr3_count = utr3_count + 1
-                        region = 'positionType=utr3'
-
-                    elif (u.isBetween(pos, cdsEnd, txtEnd) and 
-                        (cdsStart < cdsEnd) (strand == "-")):
-                        utr5_count = utr5_count + 1
-                        region = 'positionType=utr5'
-
-                    elif (u.isBetween(pos, txtStart, cdsStart) and \
-                        (cdsStart < cdsEnd) and (strand == "-")):
-                        utr3_count = utr3_count + 1
-                        region = 'positionType=utr3'
-
-                    elif (u.isBetween(pos, promoter_plus, txtStart) and \
-                        (strand == "+")):
-                        sql = 'select chrom, chromStart, chromEnd, name ' + \
-                            'from cpgIslandExt where chrom="' + str(chr) +  \
-                            '" AND (chromStart <= ' + str(pos) + ' AND ' + \
-                            str(pos) + ' <= chromEnd);'
-                        cursor.execute(sql)
-                        rows = cursor.fetchone()
-
-                        if (rows is not None):
-                            region = 'putativePromoterRegion=' + \
-                                "".join(str(rows[3]).split())
-                            promoter_count = promoter_count + 1
-
-                    elif (u.isBetween(pos, txtEnd, promoter_minus) and \
-                        (strand == "-")):
-                        sql = 'select chrom, chromStart, chromEnd, name ' + \
-                            'from cpgIslandExt where chrom="' + str(chr) + \
-                            '" AND (chromStart <= ' + str(pos) + ' AND ' + \
-                            str(pos) + ' <= chromEnd);'
-                        cursor.execute(sql)
-                        rows = cursor.fetchone()
-
-                        if (rows is not None):
-                            region = 'putativePromoterRegion=' + \
-                            "".join(str(rows[3]).split())
-                            promoter_count = promoter_count + 1
-
-                    else:
-                        region = ''
-
-                    if (region != ''):
-                        info.append(collapseGeneNames(
-                            row=row, indices=indicesKnownGenes, 
-                            region=region, cnt=cnt))
-
-                    cnt = cnt + 1
-
-                str_info = ";".join(info)
-                fields[7] = fields[7] + ';' + str_info
-                fh_out.write('\t'.join(fields) + '\n')
-
-            else:
-                fields[7] = fields[7] + ";positionType=interGenic"
-                fh_out.write('\t'.join(fields) + '\n')
-                interGenic_count = interGenic_count + 1
-
-            linenum = linenum + 1
-
-        else:
-            fh_out.write(line + '\n')
-
-    print("Variants located:")
-    fh_log.write("Variants located:\n")
-
-    print(f"In interGenic {str(interGenic_count)}")
-    fh_log.write(f"In interGenic {str(interGenic_count)}\n")
-
-    print(f"In CDS {str(cds_count)}")
-    fh_log.write(f"In CDS {str(cds_count)}\n")
-
-    print(f"In \'3 UTR {str(utr3_count)}")
-    fh_log.write(f"In \'3 UTR {str(utr3_count)}\n")
-
-    print(f"In \'5 UTR {str(utr5_count)}")
-    fh_log.write(f"In \'5 UTR {str(utr5_count)}\n")
-
-    print(f"In Intronic {str(intronic_count)}")
-    fh_log.write(f"In Intronic "+str(intronic_count) +'\n')
-
-    print(f"In Non_coding_intronic {str(non_coding_intronic_count)}")
-    fh_log.write(f"In Non_coding_intronic {str(non_coding_intronic_count)}\n")
-
-    print(f"In Exonic {str(exonic_count)}")
-    fh_log.write(f"In Exonic {str(exonic_count)}\n")
-
-    print(f"In Non_coding_exonic {str(non_coding_exonic_count)}")
-    fh_log.write(f"In Non_coding_exonic {str(non_coding_exonic_count)}\n")
-
-    print(f"In Putative Promoter Region {str(promoter_count)}")
-    fh_log.write(f"In Putative Promoter Region {str(promoter_count)}\n")
-
-    fh_out.close()
-    fh_log.close()
-    fh.close()
-    conn.close()
-
-
-"""Overlap with tfbsConsSites
-"""
-def addOverlapWithTfbsConsSites(vcf, format='vcf', table='tfbsConsSites', 
-    tmpextin='.2', tmpextout='.3', sep='\t'):
-
-    allowed_chrom=['1','2','3','4','5','6','7','8','9','10','11','12','13',
-        '14','15','16','17','18','19','20','21','22','X','Y']
-
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-
-    linenum = 1
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if (line.startswith("##")):
-            fh_out.write(line + '\n')
-
-        #header line
-        elif (line.startswith('#CHROM') or line.startswith('CHROM')):
-            fh_out.write(line + '\n')
-
-        else:
-            fields = line.split(sep)
-            chr = fields[inds[0]].strip()
-            # For some reason this table has no "chr" preceeding number
-            if not chr.startswith("chr"):
-                chr = "chr" + chr
-
-            pos=fields[inds[1]].strip()
-            isOverlap = False
-            chrIndex=chr.replace('chr', '')
-
-            if (chrIndex in allowed_chrom):
-                isOverlap = False
-                sql = 'select chrom, chromStart, chromEnd, name ' + \
-                    'from tfbsConsSites' + chrIndex + \
-                    ' where  chromStart <= ' + str(pos) + ' AND ' + \
-                    str(pos) + ' <= chromEnd;'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
-
-                if (len(rows) > 0):
-                    records_count = 1
-                    line_count = line_count + 1
-
-                    for row in rows:
-                        var_count = var_count + 1
-                        t = str(row[3]) + '.' + str(row[0]) + '.' + \
-                            str(row[1]) + '.' + str(row[2])
-                        t = t.strip()
-                        records.append('tfbsRegion' + '=' + t)
-                        records_count = records_count + 1
-
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] + ';'.join(records)
-                    else:
-                        fields[7] = fields[7] + ';' + ';'.join(records)
-
-                    fh_out.write('\t'.join(fields) + '\n')
-
-                else: # chrom is not on the list
-                    fh_out.write(line + '\n')
-
-            else: # chrom is not on the list
-                fh_out.write(line + '\n')
-
-        linenum = linenum + 1
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Overlap with GadAll table
-"""
-def addOverlapWithGadAll(vcf, format='vcf', table='gadAll', tmpextin='', 
-    tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile+'.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                # For some reason this table has no "chr" preceeding number
-                if chr.startswith("chr"):
-                    chr = str(chr).replace("chr", "")
-
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-
-                sql = 'select * from ' + table + ' where chromosome="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
-
-                if (len(rows) > 0):
-                    records_count = 1
-                    line_count = line_count + 1
-                    r_tmp = []
-                    for row in rows:
-                        var_count = var_count + 1
-                        if not fu.isOnTheList(r_tmp, str(row[3])):
-                            r_tmp.append(str(row[3]) )
-                            records.append(str(table) + '=' + str(row[3]))
-                            records_count = records_count + 1
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] + ';'.join(records)
-                    else:
-                        fields[7] = fields[7] + ';' + ';'.join(records)
-                    fh_out.write('\t '.join(fields) + '\n')
-                else:
-                    fh_out.write(line + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-""" Overlap with gwasCatalog table """
-def addOverlapWithGwasCatalog(vcf, format='vcf', table='gwasCatalog', \
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile+'.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-                
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND chromEnd = ' + str(pos) + ';'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
-
-                if (len(rows) > 0):
-                    line_count = line_count + 1
-                    records_count = 1
-                    for row in rows:
-                        var_count = var_count + 1
-                        records.append(str(table) + '=' + str('pubMedID') + \
-                            '=' + str(row[5]) + ',trait=' + str(row[10]))
-                        records_count = records_count + 1
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] + ';'.join(records)
-                    else:
-                        fields[7] = fields[7] + ';' + ';'.join(records)
-                    fh_out.write('\t'.join(fields) + '\n')
-                else:
-                    fh_out.write(line + '\n')
-
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
-
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
-
-    conn.close()
-    fh.close()
-    fh_out.close()
-
-
-"""Overlap with HUGO Gene Nomenclature Committee (HGNC) table
-"""
-def addOverlapWitHUGOGeneNomenclature(vcf, format='vcf', table='hugo', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, 
+        spec=GADALL_OVERLAP)
 
-                pos=fields[inds[1]].strip()
-                isOverlap = False
+    fh_log = open(vcf + '.count.log', 'a')
+    writeOverlapLog(fh_log, counts, table)
+    fh_log.close()
 
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchall()
-                records = []
 
-                if (len(rows) > 0):
-                    line_count = line_count + 1
-                    records_count = 1
-                    r_tmp = []
-                    for row in rows:
-                        var_count = var_count + 1
-                        t = str(str(row[5]) + ',' + str(row[6])).strip()
-                        if not fu.isOnTheList(r_tmp, t):
-                            r_tmp.append(t)
-                            records.append('HGNC_GeneAnnotation' + '=' + t)
-                        records_count = records_count + 1
+""" Overlap with gwasCatalog table """
+def addOverlapWithGwasCatalog(vcf, format='vcf', table='gwasCatalog', \
+    tmpextin='', tmpextout='.1', sep='\t'):
 
-                    records_str = ','.join(records).replace(';', ',')
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, 
+        spec=GWAS_OVERLAP)
 
-                    if str(fields[7]).endswith(';'):
-                        fields[7] = fields[7] +records_str
-                    else:
-                        fields[7] = fields[7] + ';' + records_str
-                    fh_out.write('\t'.join(fields) + '\n')
-                else:
-                    fh_out.write(line + '\n')
+    fh_log = open(vcf + '.count.log', 'a')
+    writeOverlapLog(fh_log, counts, table)
+    fh_log.close()
 
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
 
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
+"""Overlap with HUGO Gene Nomenclature Committee (HGNC) table
+"""
+def addOverlapWitHUGOGeneNomenclature(vcf, format='vcf', table='hugo', 
+    tmpextin='', tmpextout='.1', sep='\t'):
 
-    conn.close()
-    fh.close()
-    fh_out.close()
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, 
+        spec=HUGO_OVERLAP)
+
+    fh_log = open(vcf + '.count.log', 'a')
+    writeOverlapLog(fh_log, counts, table)
+    fh_log.close()
 
 
 """Overlap with segdup regions genomicSuperDups
 """
 def addOverlapWithGenomicSuperDups(vcf, format='vcf', 
     table='genomicSuperDups', tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
-
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
-
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
-
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-                otherChrom = ''
-                otherStart = ''
-                otherEnd = ''
-                l = str(isOverlap)
-
-                sql = 'select * from ' + table + ' where chrom="'+ str(chr) + \
-                    '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchone()
-
-                if rows is not None:
-                    line_count = line_count + 1
-                    var_count = var_count + 1
-                    isOverlap = True
-                    otherChrom = rows[7]
-                    otherStart = rows[8]
-                    otherEnd = rows[9]
-                    fields[7] = fields[7] + ';' + str(table) + '=' + \
-                        str(isOverlap) + ';' + 'otherChrom=' + \
-                        str(otherChrom) + ';otherStart=' + \
-                        str(otherStart) + ';otherEnd=' + str(otherEnd)
-
-                fh_out.write('\t'.join(fields) + '\n')
 
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, 
+        spec=SEGDUP_OVERLAP)
 
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
+    fh_log = open(vcf + '.count.log', 'a')
+    writeOverlapLog(fh_log, counts, table)
     fh_log.close()
 
-    conn.close()
-    fh.close()
-    fh_out.close()
-
 
 """Searches Genes Databases and returns Genes/Cytobands 
    with which SNP or INDEL overlaps
@@ -1191,213 +1172,236 @@ def addOverlapWithRefGene(vcf, format='vcf', table='refGene',
 """
 def addOverlapWithCytoband(vcf, format='vcf', table='cytoBand', 
     tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
 
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
-    colindex = 12
-    startName = 'txStart'
-    endName = 'txEnd'
+    spec = CYTOBAND_OVERLAP if (table == 'cytoBand') else GENE_BAND_OVERLAP
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, spec=spec)
 
-    if (table == 'cytoBand'):
-        colindex = 3
-        startName = 'chromStart'
-        endName = 'chromEnd'
+    fh_log = open(vcf + '.count.log', 'a')
+    writeOverlapLog(fh_log, counts, table)
+    fh_log.close()
 
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
 
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
+"""Method to find overlap with CNV tables
+"""
+def addOverlapWithCnvDatabase(vcf, format='vcf', table='dgv_Cnv', 
+    tmpextin='', tmpextout='.1', sep='\t'):
 
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-                
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (' + startName + ' <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= ' + endName + ');'
-                overlapsWith = []
-                cursor.execute(sql)
-                rows = cursor.fetchall()
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, spec=CNV_OVERLAP)
 
-                if (len(rows) > 0):
-                    line_count = line_count + 1
-                    for row in rows:
-                        var_count = var_count + 1
-                        overlapsWith.append(str(row[colindex]))
-                    overlapsWith = u.dedup(overlapsWith)
-                    cytoband = ';'.join([str(x) for x in overlapsWith])
+    fh_log = open(vcf + '.count.log', 'a')
+    writeOverlapLog(fh_log, counts, table)
+    fh_log.close()
 
-                    if str(fields[7]).endswith(";"):
-                        fields[7] = fields[7] + str(table) + '=' + str(cytoband)
-                    else:
-                        fields[7] = fields[7] + ';' + str(table) + '=' + str(cytoband)
-                fh_out.write('\t'.join(fields) + '\n')
 
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
+"""Method to find overlap with targetScanS tables
+"""
+def addOverlapWithMiRNA(vcf, format='vcf', table='targetScanS', 
+    tmpextin='', tmpextout='.1', sep='\t'):
 
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
+    counts = annotateVcfFile(vcf + tmpextin, vcf + tmpextout, overlapRecord,
+        isHeaderLine, format=format, sep=sep, table=table, 
+        spec=MIRNA_OVERLAP)
+
+    fh_log = open(vcf + '.count.log', 'a')
+    writeMiRNALog(fh_log, counts)
     fh_log.close()
 
-    conn.close()
-    fh.close()
-    fh_out.close()
 
+def writeMiRNALog(fh_log, counts, **kwargs):
+    writeOverlapLog(fh_log, counts, 'miRNAsites')
 
-"""Method to find overlap with CNV tables
+
+"""Query of the rows of table overlapping a record, as a spec describes
+   them: the chrom column matched against the record's key ("chr"-prefixed
+   chrom or bare chr) and pos inside [start, end]; start and end naming
+   the same column asks for pos to equal it
 """
-def addOverlapWithCnvDatabase(vcf, format='vcf', table='dgv_Cnv', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
+def getOverlapQuery(record, table, spec, binned_tables=()):
+    pos = record.pos
+    if (spec.get('start', 'chromStart') == spec.get('end', 'chromEnd')):
+        where = ' AND ' + spec['end'] + ' = ' + str(pos) + ';'
+    else:
+        where = ' AND (' + spec.get('start', 'chromStart') + ' <= ' + \
+            str(pos) + ' AND ' + str(pos) + ' <= ' + \
+            spec.get('end', 'chromEnd') + ');'
 
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
+    return 'select * from ' + table + ' where ' + \
+        spec.get('chrom', 'chrom') + '="' + \
+        str(getattr(record, spec.get('key', 'chrom'))) + '"' + \
+        getBinClause(table, int(pos) - 1, int(pos) + 1, binned_tables) + where
 
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
 
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
+"""tfbsConsSites is split into one table per chromosome, with no "chr"
+   before the number; records on other chromosomes are not looked up
+"""
+TFBS_CHROMS = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', 
+    '12', '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', 'X', 
+    'Y']
+
+def getTfbsConsSitesQuery(record, table, spec, binned_tables=()):
+    chrIndex = record.chrom.replace('chr', '')
+    if (chrIndex not in TFBS_CHROMS):
+        return None
+
+    pos = record.pos
+    return 'select chrom, chromStart, chromEnd, name ' + \
+        'from tfbsConsSites' + chrIndex + \
+        ' where  chromStart <= ' + str(pos) + ' AND ' + \
+        str(pos) + ' <= chromEnd' + getBinClause(table, int(pos) - 1, 
+        int(pos) + 1, binned_tables) + ';'
+
+
+"""Formatters of the hits of one record in a table, by spec: each gets 
+   the rows (only the first, for first-hit tables) and the table name and
+   returns the text added to INFO
+"""
+def formatBandHits(rows, table, column):
+    bands = u.dedup([str(row[column]) for row in rows])
+    return str(table) + '=' + ';'.join(bands)
 
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
 
-                pos = fields[inds[1]].strip()
-                isOverlap = False
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchone()
+def formatCytobandHits(rows, table):
+    return formatBandHits(rows, table, 3)
 
-                if rows is not None:
-                    line_count = line_count + 1
-                    var_count = var_count + 1
-                    isOverlap = True
-                    if str(fields[7]).endswith(";"):
-                        fields[7] = fields[7] + str(table) + '=' + \
-                        str(isOverlap)
-                    else:
-                        fields[7] = fields[7] + ';' + str(table) + \
-                        '='+str(isOverlap)
-                fh_out.write('\t'.join(fields) + '\n')
 
-            linenum = linenum + 1
-        else:
-            fh_out.write(line + '\n')
+def formatGeneBandHits(rows, table):
+    return formatBandHits(rows, table, 12)
 
-    fh_log.write(f"In {str(table)}: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
 
-    conn.close()
-    fh.close()
-    fh_out.close()
+def formatGadAllHits(rows, table):
+    return ';'.join([str(table) + '=' + name 
+        for name in u.dedup([str(row[3]) for row in rows])])
 
 
-"""Method to find overlap with targetScanS tables
-"""
-def addOverlapWithMiRNA(vcf, format='vcf', table='targetScanS', 
-    tmpextin='', tmpextout='.1', sep='\t'):
-    
-    basefile = vcf
-    vcf = basefile + tmpextin
-    outfile = basefile + tmpextout
+def formatGwasCatalogHits(rows, table):
+    return ';'.join([str(table) + '=' + str('pubMedID') + '=' + 
+        str(row[5]) + ',trait=' + str(row[10]) for row in rows])
 
-    fh_out = open(outfile, "w")
-    fh = open(vcf)
 
-    logcountfile = basefile + '.count.log'
-    fh_log = open(logcountfile, 'a')
-    var_count = 0
-    line_count = 0
+def formatHugoHits(rows, table):
+    genes = u.dedup([str(str(row[5]) + ',' + str(row[6])).strip() 
+        for row in rows])
+    return ','.join(['HGNC_GeneAnnotation' + '=' + t 
+        for t in genes]).replace(';', ',')
 
-    inds = getFormatSpecificIndices(format=format)
-    conn = u.db_connect()
-    cursor = conn.cursor()
-    linenum = 1
 
-    for line in fh:
-        line = line.strip()
-        ## not comments
-        if not line.startswith("##"):
-            #header line
-            if (line.startswith('CHROM') or line.startswith('#CHROM')):
-                fh_out.write(line + '\n')
-            else:
-                fields = line.split(sep)
-                chr = fields[inds[0]].strip()
-                if not chr.startswith("chr"):
-                    chr = "chr" + chr
+def formatCnvHits(rows, table):
+    return str(table) + '=' + str(True)
 
-                pos = fields[inds[1]].strip()
-                sql = 'select * from ' + table + ' where chrom="' + \
-                    str(chr) + '" AND (chromStart <= ' + str(pos) + \
-                    ' AND ' + str(pos) + ' <= chromEnd);'
-                cursor.execute(sql)
-                rows = cursor.fetchone()
 
-                if rows is not None:
-                    line_count = line_count + 1
-                    var_count = var_count + 1
-                    t = str(rows[4]) + ',' +  str(rows[1]) + '_' + \
-                        str(rows[2]) + '_' + str(rows[3])
-                    t = 'miRNAsites=' + t.strip()
-                    if str(fields[7]).endswith(";"):
-                        fields[7] = fields[7] + t
-                    else:
-                        fields[7] = fields[7] + ';' + t
-                fh_out.write('\t'.join(fields) + '\n')
+def formatMiRNAHits(rows, table):
+    row = rows[0]
+    t = str(row[4]) + ',' + str(row[1]) + '_' + str(row[2]) + '_' + \
+        str(row[3])
+    return 'miRNAsites=' + t.strip()
 
-            linenum = linenum + 1
+
+def formatGenomicSuperDupsHits(rows, table):
+    row = rows[0]
+    return str(table) + '=' + str(True) + ';' + 'otherChrom=' + \
+        str(row[7]) + ';otherStart=' + str(row[8]) + ';otherEnd=' + \
+        str(row[9])
+
+
+def formatTfbsConsSitesHits(rows, table):
+    return ';'.join(['tfbsRegion' + '=' + (str(row[3]) + '.' + str(row[0]) + 
+        '.' + str(row[1]) + '.' + str(row[2])).strip() for row in rows])
+
+
+"""How a reference table is overlapped with records and what its hits add
+   to INFO, for overlapRecord
+   name: pipeline step name, when not the table's
+   log: count log writer, when not writeOverlapLog
+   chrom, start, end: interval columns, when not chrom/chromStart/chromEnd
+   key: record attribute matched against chrom, when not 'chrom'
+   first: only the first hit counts (for tables of non-overlapping rows)
+   format: formatter of the hits
+   append: always add a ';' before the hits, even after one
+   pad: prefix added to every field but the first of records with hits
+   query: builds the query when the generic one does not fit; such tables
+       are never indexed
+"""
+CYTOBAND_OVERLAP = {'name': 'Cytoband', 'format': formatCytobandHits}
+GENE_BAND_OVERLAP = {'start': 'txStart', 'end': 'txEnd', 
+    'format': formatGeneBandHits}
+GADALL_OVERLAP = {'chrom': 'chromosome', 'key': 'chr', 
+    'format': formatGadAllHits, 'pad': ' '}
+GWAS_OVERLAP = {'name': 'GwasCatalog', 'start': 'chromEnd', 
+    'end': 'chromEnd', 'format': formatGwasCatalogHits}
+MIRNA_OVERLAP = {'name': 'miRNA', 'log': writeMiRNALog, 'first': True, 
+    'format': formatMiRNAHits}
+HUGO_OVERLAP = {'name': 'HUGO Gene Nomenclature Committee', 
+    'format': formatHugoHits}
+CNV_OVERLAP = {'first': True, 'format': formatCnvHits}
+SEGDUP_OVERLAP = {'first': True, 'format': formatGenomicSuperDupsHits, 
+    'append': True}
+TFBS_OVERLAP = {'name': 'addOverlapWithTfbsConsSites', 
+    'format': formatTfbsConsSitesHits, 'query': getTfbsConsSitesQuery}
+
+"""Overlap tables annotated by the pipeline, in the order they run
+   A new reference table only needs an entry here
+"""
+OVERLAP_TABLES = OrderedDict([
+    ('cytoBand', CYTOBAND_OVERLAP),
+    ('gadAll', GADALL_OVERLAP),
+    ('gwasCatalog', GWAS_OVERLAP),
+    ('targetScanS', MIRNA_OVERLAP),
+    ('hugo', HUGO_OVERLAP),
+    ('dgv_Cnv', CNV_OVERLAP),
+    ('abParts_IG_T_CelReceptors', CNV_OVERLAP),
+    ('mcCarroll_Cnv', CNV_OVERLAP),
+    ('conrad_Cnv', CNV_OVERLAP),
+    ('genomicSuperDups', SEGDUP_OVERLAP),
+    ('tfbsConsSites', TFBS_OVERLAP),
+])
+
+
+"""Overlaps one record with table and adds the hits to its INFO, as the
+   table's spec in OVERLAP_TABLES (or spec) says
+   index is an optional interval index of table (see driver.PIPELINE);
+   otherwise the table is queried
+"""
+def overlapRecord(cursor, record, counts, table, spec=None, index=None, 
+    binned_tables=()):
+
+    spec = spec or OVERLAP_TABLES[table]
+    first = spec.get('first', False)
+
+    if (index is not None):
+        if first:
+            rows = index.first(getattr(record, spec.get('key', 'chrom')), 
+                record.pos)
         else:
-            fh_out.write(line + '\n')
+            rows = index.find(getattr(record, spec.get('key', 'chrom')), 
+                record.pos)
+    else:
+        sql = spec.get('query', getOverlapQuery)(record, table, spec, 
+            binned_tables)
+        if (sql is None):
+            return
+        cursor.execute(sql)
+        if first:
+            rows = cursor.fetchone()
+        else:
+            rows = cursor.fetchall()
 
-    fh_log.write(f"In miRNAsites: {str(var_count)} in " + \
-        f"{str(line_count)} variants\n")
-    fh_log.close()
+    if first:
+        rows = [] if (rows is None) else [rows]
+    if (len(rows) == 0):
+        return
 
-    conn.close()
-    fh.close()
-    fh_out.close()
+    counts['line'] = counts['line'] + 1
+    counts['var'] = counts['var'] + len(rows)
+
+    text = spec['format'](rows, table)
+    if spec.get('append', False):
+        record.appendInfo(';' + text)
+    else:
+        record.addInfo(text)
+
+    if (spec.get('pad') is not None):
+        record.padFields(spec['pad'])
 
-### EOF
\ No newline at end of file
+### EOF
@@ -5,134 +5,435 @@ import botocore.client
 import json
 import os
 import re
-import subprocess
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import job_lanes
+import job_pool
 
 # Get ann_config configuration
 from configparser import SafeConfigParser
 config = SafeConfigParser(os.environ)
 config.read(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'ann_config.ini'))
 
-# Connect to SQS and get the message queue
+# Fork the annotation workers before any AWS clients exist; each keeps its
+# imports, clients, database connections and indexes warm between jobs
+pool = job_pool.JobPool(job_pool.getPoolSize(config))
+
+# Jobs are only received and admitted with a free worker, spare cores and
+# this much memory and disk each; until then messages stay on the queue for
+# other instances
+jobs_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'jobs')
+job_memory = int(config['annotator']['JobMemoryMB']) * 1024 * 1024
+job_disk = int(config['annotator']['JobDiskMB']) * 1024 * 1024
+admit_wait = int(config['annotator']['AdmitWaitSeconds'])
+blocked = None
+
+# Received jobs are ordered in priority lanes, by user tier and input size;
+# no more are received than can be admitted, so these lanes only reorder the
+# jobs of one receive. Across the backlog, lanes are kept apart by their own
+# request queues (see receiveMessages)
+lane_weights = job_lanes.parseLaneWeights(config['annotator']['LaneWeights'])
+lanes = job_lanes.LaneScheduler(lane_weights,
+    int(config['annotator']['SmallJobMB']) * 1024 * 1024,
+    int(config['annotator']['MaxLaneWaitSeconds']) or None)
+lane_stats_interval = int(config['annotator']['LaneStatsSeconds'])
+lane_stats_time = time.time()
+
+# Connect to SQS and get the message queues: the lane queues that job
+# requests are routed to by their user_role and input_size attributes, if
+# any, and the requests queue, for requests routed to no lane, polled with
+# the weight of the lightest lane
 sqs = boto3.resource('sqs', region_name=config['aws']['AwsRegionName'], config=botocore.client.Config(signature_version = 's3v4'))
 queue = sqs.Queue(config['sqs']['RequestsURL'])
+receive_queues = [(lane, sqs.Queue(url), dict(lane_weights).get(lane, 1.0))
+    for lane, url in job_lanes.parseLaneURLs(config['sqs']['LaneURLs'])]
+receive_queues.append(('default', queue, min([w for l, w in lane_weights] or [1.0])))
+
+# Inputs are downloaded on a thread pool with one S3 client, which unlike
+# boto3 resources is safe to share between threads
+s3_client = boto3.client('s3', region_name=config['aws']['AwsRegionName'], config=botocore.client.Config(signature_version = 's3v4'))
+downloads = ThreadPoolExecutor(max_workers=int(config['annotator']['DownloadThreads']))
+
+# Exceptions found in dynamoDB boto documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html
+dynamo = boto3.resource('dynamodb', region_name=config['aws']['AwsRegionName'], config=botocore.client.Config(signature_version = 's3v4'))
+try:
+    dynamo_table = dynamo.Table(config['dynamo']['TableName'])
+except ClientError as e:
+    error = e.response['Error']
+    print(f"Error: Unable to access DynamoDB table: {error['Message']}")
 
-# Set visibility timeout to 15 minutes because this is around the amount of time it takes for a t2.nano to process the largest file, premium_2.vcf
+# Set a short visibility timeout: messages are kept invisible by heartbeats
+# for as long as their jobs run, so it need not cover the largest file, and
+# the message of a job that dies is delivered again within the timeout
 # set_attributes() from boto documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Queue.set_attributes
 # Visibility timeout information from AWS documentation: https://docs.aws.amazon.com/AWSSimpleQueueService/latest/SQSDeveloperGuide/sqs-visibility-timeout.html
-queue.set_attributes(Attributes={'VisibilityTimeout': '1000'})
+visibility_timeout = int(config['annotator']['VisibilityTimeout'])
+heartbeat_interval = int(config['annotator']['HeartbeatSeconds'])
+for lane, lane_queue, weight in receive_queues:
+    lane_queue.set_attributes(Attributes={'VisibilityTimeout': str(visibility_timeout)})
 
-# Poll the message queue in a loop 
-while True:
+# Stride scheduling of receives: a queue's pass advances by 1 / weight for
+# every message received from it, and the queue with the lowest pass is
+# polled first; an empty queue is given no credit for the time it was empty
+receive_passes = dict((lane, 0.0) for lane, lane_queue, weight in receive_queues)
+receive_clock = 0.0
 
-    # Attempt to read a message from the queue using long polling
-    # Receive one message at a time as a best practice, so that in the case where there were other instances picking up messages each message will only get picked up once
-    # Use of receive_messages() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.receive_message
-    messages = queue.receive_messages(MaxNumberOfMessages=1, WaitTimeSeconds=5)
+# Messages kept invisible, by receipt handle, from when they are received
+# until their job succeeds (deleted) or fails (released), and the message
+# of every submitted job by job id
+held = {}
+held_lock = threading.Lock()
+job_messages = {}
 
-    # If message read, extract job parameters from the message body as before
-    if len(messages) > 0:
-        for message in messages:
-            sqs_body = json.loads(message.body)
-            data = json.loads(sqs_body['Message'])
+# Messages received max_receives times without their job succeeding, and
+# requests that can never succeed, are sent to the dead-letter queue, when
+# there is one, and deleted
+max_receives = int(config['annotator']['MaxReceives'])
+dead_letters = sqs.Queue(config['annotator']['DeadLetterURL']) if config['annotator']['DeadLetterURL'] else None
 
-            # Include below the same code you used in prior homework
-            # Get the input file S3 object and copy it to a local file
-            # Use a local directory structure that makes it easy to organize
-            # multiple running annotation jobs
-            if not isinstance(data, dict):
-                print('Error: Data is not in correct format (dictionary)')
+# SQS returns at most 10 messages per receive and deletes at most 10 per batch
+SQS_BATCH_SIZE = 10
 
-            try:
-                bucket_name = data['s3_inputs_bucket']
-            except:
-                print('Error: bucket name does not exist in data')
-            try:
-                key = data['s3_key_input_file']
-            except:
-                print('Error: key does not exist in data')
-            try:
-                job_id = data['job_id']
-            except:
-                print('Error: job_id does not exist in data')
-            try:
-                input_file = data['input_file_name']
-            except:
-                print('Error: file name does not exist in data')
-            subfolder = re.split('~',key)[0].replace('/','~')
+"""Extracts the job parameters from a job request message and looks up the
+   size of its input file, for its lane
+   Returns the job, or None when it cannot be run now; raises ValueError for
+   a request that can never be run
+"""
+def readJob(message):
+    sqs_body = json.loads(message.body)
+    data = json.loads(sqs_body['Message'])
+
+    if not isinstance(data, dict):
+        raise ValueError('Data is not in correct format (dictionary)')
+
+    try:
+        bucket_name = data['s3_inputs_bucket']
+        key = data['s3_key_input_file']
+        job_id = data['job_id']
+        input_file = data['input_file_name']
+    except KeyError as e:
+        raise ValueError(f'{e} does not exist in data')
+
+    if input_file.find('.vcf') < 0:
+        raise ValueError('Annotation file is not in .vcf file format')
+
+    try:
+        # head_object() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.head_object
+        size = s3_client.head_object(Bucket=bucket_name, Key=key)['ContentLength']
+    except ClientError as e:
+        error = e.response['Error']
+        if error['Code'] in ('404', 'NoSuchKey'):
+            raise ValueError(f"Input file does not exist: {error['Message']}")
+        print(f"Error: Unable to find input file: {error['Message']}")
+        return None
+
+    # Requests from before tiers were sent along are served as free
+    return {'message': message, 'job_id': job_id, 'bucket': bucket_name,
+        'key': key, 'input_file': input_file, 'size': size,
+        'tier': data.get('user_role'), 'submit_time': data.get('submit_time')}
+
+"""The job's own folder under jobs/, from the S3 key of its input file
+"""
+def getJobFolder(key):
+    # Use a local directory structure that makes it easy to organize
+    # multiple running annotation jobs
+    return re.split('~',key)[0].replace('/','~')
+
+"""Downloads the input file of job into the job's own folder under jobs/
+   Returns the local input path, or None when it cannot be downloaded
+"""
+def fetchInput(job):
+    # Get the input file S3 object and copy it to a local file
+    subfolder = getJobFolder(job['key'])
+
+    # Check that folders that will house the annotated file exist
+    # Use of os.makedirs() from: https://docs.python.org/3/library/os.html#os.makedirs
+    try:
+        os.makedirs(f'{jobs_dir}/{subfolder}', exist_ok=True)
+    except OSError:
+        print('Failed to create unique subfolder to store annotation job')
+        return None
+
+    # Download file from S3 bucket
+    try:
+        # download_file() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.download_file
+        s3_client.download_file(Bucket=job['bucket'], Key=job['key'], Filename=f"{jobs_dir}/{subfolder}/{job['input_file']}")
+    except ClientError as e:
+        error = e.response['Error']
+        print(f"Error: Unable to download file: {error['Message']}")
+        return None
+
+    return f"{jobs_dir}/{subfolder}/{job['input_file']}"
+
+"""Receives up to count messages, from the request queues in weighted-fair
+   order; the first queue polled waits up to wait seconds for messages and
+   the rest only wait while nothing has been received
+"""
+def receiveMessages(count, wait):
+    global receive_clock
+    messages = []
+    for lane, lane_queue, weight in sorted(receive_queues, key=lambda q: (receive_passes[q[0]], -q[2])):
+        if len(messages) >= count:
+            break
+        # Use of receive_messages() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.receive_message
+        received = lane_queue.receive_messages(AttributeNames=['ApproximateReceiveCount'], MaxNumberOfMessages=min(SQS_BATCH_SIZE, count - len(messages)), WaitTimeSeconds=(0 if len(messages) > 0 else wait))
+        if len(received) > 0:
+            receive_clock = max(receive_clock, receive_passes[lane])
+            receive_passes[lane] = receive_passes[lane] + len(received) / weight
+        else:
+            receive_passes[lane] = max(receive_passes[lane], receive_clock)
+        messages.extend(received)
+    return messages
 
-            if input_file.find('.vcf') < 0:
-                print('Error: Annotation file is not in .vcf file format')
+"""Messages grouped by the URL of the queue they were received from
+"""
+def groupByQueue(messages):
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.queue_url, []).append(message)
+    return groups.items()
 
-            s3 = boto3.resource('s3', region_name=config['aws']['AwsRegionName'], config=botocore.client.Config(signature_version = 's3v4'))
-            # Accessing bucket and existence check from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/guide/migrations3.html
+"""Deletes messages from their queues, SQS_BATCH_SIZE per request
+"""
+def deleteMessages(messages):
+    for queue_url, queue_messages in groupByQueue(messages):
+        for i in range(0, len(queue_messages), SQS_BATCH_SIZE):
+            entries = [{'Id': str(n), 'ReceiptHandle': message.receipt_handle}
+                for n, message in enumerate(queue_messages[i:i + SQS_BATCH_SIZE])]
             try:
-                s3.meta.client.head_bucket(Bucket=bucket_name)
+                # delete_message_batch() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.delete_message_batch
+                response = sqs.meta.client.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+                for failure in response.get('Failed', []):
+                    print(f"Message failed to be deleted: {failure.get('Message')}")
             except ClientError as e:
                 error = e.response['Error']
-                if error['Code'] == '404':
-                    print(f"Error: {bucket_name} does not exist: {error['Message']}")
-
-            # Use of os.path.expanduser() from: https://stackoverflow.com/questions/40662821/tilde-isnt-working-in-subprocess-popen
-            current_filepath = os.path.abspath(os.path.dirname(__file__))
-
-            # Check that folders that will house the annotated file exist
-            if not os.path.exists(f'{current_filepath}/jobs'):
-                try:
-                    # Make jobs subfolder within annotation to store all jobs
-                    # Use of os.mkdir() from: https://www.geeksforgeeks.org/create-a-directory-in-python/
-                    os.mkdir(f'{current_filepath}/jobs')
-                except:
-                    print('Failed to create subfolder to store annotation jobs')
-            if not os.path.exists(f'{current_filepath}/jobs/{subfolder}'):
-                try:
-                    # Create subfolder with unique id
-                    os.mkdir(f'{current_filepath}/jobs/{subfolder}')
-                except:
-                    print('Failed to create unique subfolder to store annotation job')
-
-            # Download file from S3 bucket
+                print(f"Error: Unable to delete messages: {error['Message']}")
+
+"""Sets the visibility timeout of messages, SQS_BATCH_SIZE per request
+"""
+def setVisibility(messages, timeout):
+    for queue_url, queue_messages in groupByQueue(messages):
+        for i in range(0, len(queue_messages), SQS_BATCH_SIZE):
+            entries = [{'Id': str(n), 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': timeout}
+                for n, message in enumerate(queue_messages[i:i + SQS_BATCH_SIZE])]
             try:
-                # download_file() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.download_file
-                s3.meta.client.download_file(Bucket=bucket_name, Key=key, Filename=f'{current_filepath}/jobs/{subfolder}/{input_file}')
+                # change_message_visibility_batch() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Client.change_message_visibility_batch
+                response = sqs.meta.client.change_message_visibility_batch(QueueUrl=queue_url, Entries=entries)
+                for failure in response.get('Failed', []):
+                    print(f"Message visibility failed to be changed: {failure.get('Message')}")
             except ClientError as e:
                 error = e.response['Error']
-                print(f"Error: Unable to download file: {error['Message']}")
+                print(f"Error: Unable to change message visibility: {error['Message']}")
 
-            if not os.path.exists(f'{current_filepath}/run.py'):
-                print('Annotator file does not exist')
+"""Extends the visibility timeout of every held message each
+   heartbeat_interval seconds, on its own thread so long downloads and 
+   polls do not delay it
+"""
+def heartbeat():
+    while True:
+        time.sleep(heartbeat_interval)
+        with held_lock:
+            messages = list(held.values())
+        setVisibility(messages, visibility_timeout)
 
-            # Launch annotation job as a background process
-            try:
-                args = ['python', f'{current_filepath}/run.py', f'{current_filepath}/jobs/{subfolder}/{input_file}']
-                ann_process = subprocess.Popen(args)
-            except:
-                print('Annotator failed to run')
+def release(messages):
+    with held_lock:
+        for message in messages:
+            held.pop(message.receipt_handle, None)
 
-            # Delete the message from the queue, if job was successfully submitted
-            try:
-                message.delete()
-            except:
-                print('Message failed to be deleted')
+def getReceiveCount(message):
+    return int((message.attributes or {}).get('ApproximateReceiveCount', 1))
 
-            # Update job status in DynamoDB table to RUNNING
-            dynamo = boto3.resource('dynamodb', region_name=config['aws']['AwsRegionName'], config=botocore.client.Config(signature_version = 's3v4'))
+"""Job parameters of a job request message, or None when it has none
+"""
+def readRequest(message):
+    try:
+        data = json.loads(json.loads(message.body)['Message'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    return data if isinstance(data, dict) else None
 
-            # Exceptions found in dynamoDB boto documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html
-            try:
-                dynamo_table = dynamo.Table(config['dynamo']['TableName'])
-            except ClientError as e:
-                error = e.response['Error']
-                print(f"Error: Unable to access DynamoDB table: {error['Message']}")
+"""Removes whatever a failed attempt at the jobs of messages left in their
+   folders under jobs/; a retry downloads the input again
+"""
+def removeJobFiles(messages):
+    for message in messages:
+        data = readRequest(message)
+        if (data is not None) and isinstance(data.get('s3_key_input_file'), str):
+            shutil.rmtree(f"{jobs_dir}/{getJobFolder(data['s3_key_input_file'])}", ignore_errors=True)
+
+"""Marks the jobs of messages FAILED in DynamoDB, unless they completed
+"""
+def failJobs(messages):
+    for message in messages:
+        data = readRequest(message)
+        if (data is None) or ('job_id' not in data):
+            continue
+        try:
+            # Use of update_item() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.update_item
+            dynamo_table.update_item(Key={'job_id': data['job_id']},
+                                     UpdateExpression='SET job_status = :f',
+                                     ExpressionAttributeValues={':f': 'FAILED'},
+                                     ConditionExpression=Attr('job_status').ne('COMPLETED'))
+        except ClientError as e:
+            error = e.response['Error']
+            if error['Code'] != 'ConditionalCheckFailedException':
+                print(f"Error: Unable to update item: {error['Message']}")
+
+"""Removes messages from the queue for good, after copying them to the
+   dead-letter queue when there is one, and fails their jobs
+"""
+def discard(messages, reason):
+    for message in messages:
+        print(f'Error: Discarding job request after {getReceiveCount(message)} receives: {reason}')
+    removeJobFiles(messages)
+    failJobs(messages)
+    if dead_letters is None:
+        deleteMessages(messages)
+        return
+
+    # Keep on the queue what could not be dead-lettered
+    dead = []
+    for i in range(0, len(messages), SQS_BATCH_SIZE):
+        batch = messages[i:i + SQS_BATCH_SIZE]
+        entries = [{'Id': str(n), 'MessageBody': message.body} for n, message in enumerate(batch)]
+        try:
+            # send_messages() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#SQS.Queue.send_messages
+            response = dead_letters.send_messages(Entries=entries)
+            failed = [int(f['Id']) for f in response.get('Failed', [])]
+        except ClientError as e:
+            error = e.response['Error']
+            print(f"Error: Unable to dead-letter messages: {error['Message']}")
+            failed = list(range(len(batch)))
+        dead.extend([message for n, message in enumerate(batch) if n not in failed])
+    deleteMessages(dead)
+
+"""Gives the messages of jobs that did not succeed another try, right away
+   when now is set and otherwise once their visibility timeout expires,
+   unless they have been received max_receives times already
+   The files the attempt left under jobs/ are removed either way
+"""
+def retry(messages, reason, now=False):
+    release(messages)
+    exhausted = [m for m in messages if getReceiveCount(m) >= max_receives]
+    discard(exhausted, reason)
+    removeJobFiles([m for m in messages if m not in exhausted])
+    if now:
+        setVisibility([m for m in messages if m not in exhausted], 0)
+
+threading.Thread(target=heartbeat, daemon=True).start()
 
+# Poll the message queue in a loop 
+while True:
+
+    # Report jobs the workers finished and replace any worker that died
+    # Messages are deleted only for jobs that succeeded; those of failed jobs
+    # are made visible again at once, so another worker retries them
+    succeeded_messages = []
+    failed_messages = []
+    for job_id, succeeded, error in pool.done():
+        message = job_messages.pop(job_id, None)
+        if not succeeded:
+            print(f'Error: Annotation job {job_id} failed: {error}')
+        if message is None:
+            continue
+        if succeeded:
+            succeeded_messages.append(message)
+        else:
+            failed_messages.append(message)
+    release(succeeded_messages)
+    deleteMessages(succeeded_messages)
+    retry(failed_messages, 'annotation job failed', now=True)
+
+    # Receive nothing while at capacity: only as many jobs as there are
+    # workers free and memory and disk for, less those already received
+    admitted, reason = job_pool.getAdmission(pool, jobs_dir, job_memory, job_disk)
+    if admitted == 0:
+        if reason != blocked:
+            print(f'Not admitting jobs: {reason}')
+        blocked = reason
+        time.sleep(admit_wait)
+        continue
+    blocked = None
+
+    # Attempt to read messages from the queues using long polling; long poll
+    # only when there is nothing already received to dispatch, and briefly
+    # when there are several queues to go round
+    room = admitted - len(lanes)
+    if room > 0:
+        messages = receiveMessages(room, 1 if (len(lanes) > 0) or (len(receive_queues) > 1) else 5)
+        with held_lock:
+            for message in messages:
+                held[message.receipt_handle] = message
+
+        # Read the requests and size their inputs concurrently
+        reads = dict((downloads.submit(readJob, message), message) for message in messages)
+        for read in as_completed(reads):
             try:
-                # Use of update_item() from:
-                #   - boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.update_item
-                #   - example 1: https://www.programcreek.com/python/example/103724/boto3.dynamodb.conditions.Attr
-                #   - example 2: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/GettingStarted.Python.03.html
-                dynamo_table.update_item(Key={'job_id': job_id},
-                                         UpdateExpression='SET job_status = :r',
-                                         ExpressionAttributeValues={':r': 'RUNNING'},
-                                         ConditionExpression=Attr('job_status').eq('PENDING'))
-            except ClientError as e:
-                error = e.response['Error']
-                print(f"Error: Unable to update item: {error['Message']}")
\ No newline at end of file
+                job = read.result()
+            except ValueError as e:
+                # Requests that can never be run are not retried
+                release([reads[read]])
+                discard([reads[read]], e)
+                continue
+            except Exception as e:
+                print(f'Error: Unable to read job request: {e}')
+                job = None
+            if job is None:
+                # Delivered again once its visibility timeout expires
+                retry([reads[read]], 'job request could not be read')
+                continue
+            lanes.put(job)
+
+    # Report the jobs dispatched from each lane and how long they waited
+    if time.time() - lane_stats_time >= lane_stats_interval:
+        for lane, (count, mean_lane, max_lane, mean_wait, max_wait) in sorted(lanes.getWaitStats().items()):
+            print(f'Lane {lane}: {count} jobs, mean wait {mean_wait:.1f} s, max wait {max_wait:.1f} s since submission, ' +
+                f'mean {mean_lane:.1f} s, max {max_lane:.1f} s in the lane')
+        lane_stats_time = time.time()
+
+    # Take the next jobs from the lanes, as many as there are workers free
+    # and memory and disk for, download their inputs concurrently and hand
+    # each job to the workers as soon as its own download finishes
+    dispatched = []
+    while (len(dispatched) < admitted) and (len(lanes) > 0):
+        dispatched.append(lanes.get())
+    fetches = dict((downloads.submit(fetchInput, job), job) for job in dispatched)
+    for fetch in as_completed(fetches):
+        job = fetches[fetch]
+        try:
+            input_path = fetch.result()
+        except Exception as e:
+            print(f'Error: Unable to download file: {e}')
+            input_path = None
+        if input_path is None:
+            retry([job['message']], 'input file could not be downloaded')
+            continue
+        job_id = job['job_id']
+
+        # Hand the annotation job to the next free worker in the pool
+        try:
+            pool.submit(job_id, input_path)
+        except:
+            print('Annotator failed to run')
+            retry([job['message']], 'annotation job could not be submitted')
+            continue
+        job_messages[job_id] = job['message']
+
+        # Update job status in DynamoDB table to RUNNING; a retried job is
+        # RUNNING already
+        try:
+            # Use of update_item() from:
+            #   - boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Table.update_item
+            #   - example 1: https://www.programcreek.com/python/example/103724/boto3.dynamodb.conditions.Attr
+            #   - example 2: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/GettingStarted.Python.03.html
+            dynamo_table.update_item(Key={'job_id': job_id},
+                                     UpdateExpression='SET job_status = :r',
+                                     ExpressionAttributeValues={':r': 'RUNNING'},
+                                     ConditionExpression=Attr('job_status').is_in(['PENDING', 'RUNNING']))
+        except ClientError as e:
+            error = e.response['Error']
+            print(f"Error: Unable to update item: {error['Message']}")
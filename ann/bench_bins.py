@@ -0,0 +1,125 @@
+# bench_bins.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Measures range query latency on the UCSC tables with and without the
+# bin index
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import sys
+import time
+
+import annotate as ann
+import driver
+import utils as u
+
+"""Tables benchmarked by default, with their chrom, start and end columns
+"""
+BENCH_TABLES = {
+    'refGene': ('chrom', 'txStart', 'txEnd'),
+    'cpgIslandExt': ('chrom', 'chromStart', 'chromEnd'),
+    'gwasCatalog': ('chrom', 'chromStart', 'chromEnd'),
+    'targetScanS': ('chrom', 'chromStart', 'chromEnd'),
+    'dgv_Cnv': ('chrom', 'chromStart', 'chromEnd'),
+    'genomicSuperDups': ('chrom', 'chromStart', 'chromEnd'),
+}
+
+
+"""Positions to probe table with: the midpoints of samples random rows,
+   so every query has at least one hit
+"""
+def samplePositions(cursor, table, chrom, start, end, samples):
+    cursor.execute('select ' + chrom + ', ' + start + ', ' + end + ' from ' +
+        table + ' order by rand() limit ' + str(samples) + ';')
+    return [(str(row[0]), (int(row[1]) + int(row[2])) // 2)
+        for row in cursor.fetchall()]
+
+
+"""Query the pipeline runs at pos on chromosome c of table, with or without
+   the bin predicate: the Genes step's, promoter offset and all, for 
+   refGene and an overlap query for the rest
+"""
+def getQuery(table, chrom, start, end, c, pos, binned):
+    binned_tables = (table,) if binned else ()
+    if (table == 'refGene'):
+        args = [step['args'] for step in driver.PIPELINE 
+            if (step['annotate'] is ann.genesRecord)][0]
+        return ann.getGenesQuery(c, pos, table, args['promoter_offset'],
+            binned_tables)
+    return 'select * from ' + table + ' where ' + chrom + '="' + c + '"' + \
+        ann.getBinClause(table, pos - 1, pos + 1, binned_tables) + \
+        ' AND (' + start + ' <= ' + str(pos) + ' AND ' + str(pos) + \
+        ' <= ' + end + ');'
+
+
+def timeQuery(cursor, sql):
+    t = time.perf_counter()
+    cursor.execute(sql)
+    cursor.fetchall()
+    return time.perf_counter() - t
+
+
+"""Seconds taken by the queries of table at positions without and with the
+   bin predicate, run in turns at every position, whichever went second at
+   the last position going first, so neither gets the warmer caches
+"""
+def timeQueries(cursor, table, chrom, start, end, positions):
+    before = []
+    after = []
+    for i, (c, pos) in enumerate(positions):
+        plain = getQuery(table, chrom, start, end, c, pos, False)
+        binned = getQuery(table, chrom, start, end, c, pos, True)
+        if (i % 2 == 0):
+            before.append(timeQuery(cursor, plain))
+            after.append(timeQuery(cursor, binned))
+        else:
+            after.append(timeQuery(cursor, binned))
+            before.append(timeQuery(cursor, plain))
+    return (before, after)
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    return (f"mean {1000 * sum(latencies) / n:.3f} ms, " +
+        f"median {1000 * latencies[n // 2]:.3f} ms, " +
+        f"p95 {1000 * latencies[min(n - 1, int(n * 0.95))]:.3f} ms")
+
+
+"""Runs the same sampled positions against each table without and with the
+   bin predicate and prints the latencies side by side; a first pass over
+   the positions warms the caches and is not counted
+"""
+def benchmark(tables=None, samples=1000):
+    conn = u.db_connect()
+    cursor = conn.cursor()
+
+    for table in (tables or list(BENCH_TABLES)):
+        chrom, start, end = BENCH_TABLES[table]
+        positions = samplePositions(cursor, table, chrom, start, end, samples)
+        if (len(positions) == 0):
+            print(f"{table} - empty")
+            continue
+
+        timeQueries(cursor, table, chrom, start, end, positions)
+        before, after = timeQueries(cursor, table, chrom, start, end,
+            positions)
+        print(f"{table} ({len(positions)} queries)")
+        print(f"  without bin: {summarize(before)}")
+        print(f"  with bin:    {summarize(after)}")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    if (len(sys.argv) > 1) and sys.argv[1].isdigit():
+        benchmark(sys.argv[2:], int(sys.argv[1]))
+    elif len(sys.argv) > 1:
+        benchmark(sys.argv[1:])
+    else:
+        benchmark()
+
+### EOF
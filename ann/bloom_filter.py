@@ -0,0 +1,161 @@
+# bloom_filter.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Memory-mapped Bloom filter over the dbSNP (CHR, POS, REF) keys, so
+# variants that are certainly not in dbSNP skip the query
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+
+import utils as u
+
+"""Filters already mapped by this worker, keyed by path
+"""
+FILTERS = {}
+
+BLOOM_MAGIC = b'ANNBLOM1'
+
+# magic, then bits, hashes and keys added, as little-endian uint64
+BLOOM_HEADER = struct.Struct('<8sQQQ')
+
+# False positive rate the filter is built for when none is given
+BLOOM_ERROR_RATE = 0.01
+
+# dbSNP rows streamed per fetch while building
+BLOOM_FETCH_SIZE = 10000
+
+
+"""Set of keys that answers "maybe" or "certainly not": a bit array of
+   nbits bits, nhashes of which are set for every key added
+   Built in memory with add, or mapped read-only from a file written by
+   write, which every worker on the host then shares
+"""
+class BloomFilter(object):
+    def __init__(self, nbits, nhashes, bits=None, count=0):
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.count = count
+        self.bits = bits if (bits is not None) else \
+            bytearray((nbits + 7) // 8)
+        self.offset = 0
+
+    """Bits of key: double hashing of one 128-bit digest
+    """
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'),
+            digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+    def add(self, key):
+        for p in self.positions(key):
+            self.bits[p >> 3] = self.bits[p >> 3] | (1 << (p & 7))
+        self.count = self.count + 1
+
+    def __contains__(self, key):
+        for p in self.positions(key):
+            if not (self.bits[self.offset + (p >> 3)] & (1 << (p & 7))):
+                return False
+        return True
+
+    """Writes the filter to path, replacing it atomically so running
+       workers keep their old copy
+    """
+    def write(self, path):
+        tmppath = path + '.tmp'
+        fh = open(tmppath, 'wb')
+        fh.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.nbits, self.nhashes,
+            self.count))
+        fh.write(self.bits)
+        fh.close()
+        os.replace(tmppath, path)
+
+
+"""Maps a filter file written by BloomFilter.write
+"""
+def openBloomFilter(path):
+    fh = open(path, 'rb')
+    mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    fh.close()
+
+    magic, nbits, nhashes, count = BLOOM_HEADER.unpack(
+        mm[:BLOOM_HEADER.size])
+    if (magic != BLOOM_MAGIC):
+        raise ValueError(f"{path} is not an annotator Bloom filter")
+
+    bloom = BloomFilter(nbits, nhashes, bits=mm, count=count)
+    bloom.offset = BLOOM_HEADER.size
+    return bloom
+
+
+def getBloomFilter(path):
+    if path not in FILTERS:
+        FILTERS[path] = openBloomFilter(path)
+    return FILTERS[path]
+
+
+"""Bits and hashes a filter of count keys needs for error_rate false
+   positives: m = -n ln p / (ln 2)^2 and k = m / n ln 2
+"""
+def getBloomSize(count, error_rate=BLOOM_ERROR_RATE):
+    count = max(count, 1)
+    nbits = int(math.ceil(-count * math.log(error_rate) / (math.log(2) ** 2)))
+    nhashes = max(1, int(round(nbits / count * math.log(2))))
+    return (nbits, nhashes)
+
+
+"""Key of a dbSNP row or VCF record as MySQL compares it in dbSnpRecord:
+   case-insensitively, ignoring trailing spaces, POS as a number
+"""
+def getDbSnpKey(chr, pos, ref):
+    return str(chr).rstrip(' ').upper() + ':' + str(int(pos)) + ':' + \
+        str(ref).rstrip(' ').upper()
+
+
+"""Builds the filter of every dbSNP row, whatever its variant class,
+   streaming the table so it never sits in memory whole
+"""
+def buildDbSnpFilter(error_rate=BLOOM_ERROR_RATE):
+    conn = u.db_connect()
+    cursor = conn.cursor()
+    cursor.execute('select count(*) from dbSNP;')
+    nbits, nhashes = getBloomSize(int(cursor.fetchone()[0]), error_rate)
+    cursor.close()
+
+    bloom = BloomFilter(nbits, nhashes)
+    cursor = conn.cursor(unbuffered=True)
+    cursor.execute('select CHR, POS, REF from dbSNP;')
+    rows = cursor.fetchmany(BLOOM_FETCH_SIZE)
+    while (len(rows) > 0):
+        for row in rows:
+            if (row[1] is not None):
+                bloom.add(getDbSnpKey(row[0], row[1], row[2]))
+        rows = cursor.fetchmany(BLOOM_FETCH_SIZE)
+    cursor.close()
+    conn.close()
+
+    return bloom
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        error_rate = float(sys.argv[2]) if (len(sys.argv) > 2) else \
+            BLOOM_ERROR_RATE
+        bloom = buildDbSnpFilter(error_rate)
+        bloom.write(sys.argv[1])
+        print(f"dbSNP - {bloom.count} keys in {bloom.nbits // 8} bytes, " +
+            f"{bloom.nhashes} hashes")
+    else:
+        print("Usage: bloom_filter.py <filter_file> [error_rate]")
+
+### EOF
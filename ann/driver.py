@@ -12,110 +12,631 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 import sys
 import os
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import file_utils as fu
 import annotate as ann
+import bloom_filter as bf
+import interval_index as ii
+import planner as pl
+import utils as u
+import variant_cache as vc
+import vcf_sort as vs
+
+"""Pipeline step of an overlap table in annotate.OVERLAP_TABLES, indexed
+   on its spec's interval columns unless it has a query of its own
+"""
+def getOverlapStep(table):
+    spec = ann.OVERLAP_TABLES[table]
+    step = {'name': spec.get('name', table), 'annotate': ann.overlapRecord,
+        'args': {'table': table}, 'log': spec.get('log', ann.writeOverlapLog)}
+    if (spec.get('query') is None):
+        index = dict([(k, v) for k, v in spec.items() 
+            if k in ('chrom', 'start', 'end', 'key')])
+        index['table'] = table
+        step['indexes'] = {'index': index}
+    return step
+
+
+"""Annotation steps in the order they are applied to every record
+   name: printed on completion
+   annotate: per-record annotator, called with the cursor, the 
+       VariantRecord, the step's Counter and args
+   log: writer for the step's section of the count log
+   prefetch: optional batch lookup, resolves a whole chunk of records up 
+       front and is passed to annotate as lookup
+   table: the table a step with a prefetch looks up, for planning
+   indexes: optional interval indexes passed to annotate, keyed by argument
+       name; each names its table, the table's interval columns when not 
+       chrom/chromStart/chromEnd, the record key looked up in it when not 
+       'chrom', memoize to cache lookups for the job and load to build the
+       index with other than interval_index.getTableIndex
+   filter: optional argument name the job's Bloom filter of the step's 
+       table is passed in, to skip lookups it rules out
+   The overlap tables follow, one step each (getOverlapStep)
+"""
+PIPELINE = [
+    {'name': 'dbSNP', 'annotate': ann.dbSnpRecord, 'args': {}, 
+        'log': ann.writeDbSnpLog, 'prefetch': ann.getDbSnpBatch, 
+        'table': 'dbSNP', 'filter': 'bloom'},
+    {'name': 'BigRefGene', 'annotate': ann.bigRefGeneRecord, 'args': {}, 
+        'log': None, 
+        'indexes': {'index': {'table': 'chrom_pos_unequal', 'chrom': 'CHR', 
+            'start': 'start', 'end': 'end', 
+            'load': ii.getBigRefGeneIndex}}},
+    {'name': 'Genes', 'annotate': ann.genesRecord, 
+        'args': {'table': 'refGene', 'promoter_offset': 500},
+        'log': ann.writeGenesLog, 
+        'indexes': {'cpg_index': {'table': 'cpgIslandExt', 'memoize': True}}}
+] + [getOverlapStep(table) for table in ann.OVERLAP_TABLES]
+
+
+"""Interval columns of an index spec, for loading its table
+"""
+def getIndexColumns(spec):
+    return dict([(k, v) for k, v in spec.items() 
+        if k in ('chrom', 'start', 'end')])
+
+
+"""Returns the arguments each pipeline step runs with in this worker
+   Steps get the interval index of every table of theirs in index_tables,
+   mapped from its snapshot when snapshot_dir holds one; memoized indexes
+   are wrapped afresh on every call, so their cache lasts one job
+   Tables in join_tables (and not in index_tables) get an OverlapJoin, 
+   which annotateLines loads for every chunk
+   Steps querying a table get binned_tables, the tables whose queries are
+   narrowed to their UCSC bins
+   Tables in sweep_tables get a SweepIndex ahead of all of these; only pass
+   them for position-sorted input
+   Steps with a filter get the Bloom filter mapped from bloom_file
+"""
+def getStepArgs(cursor, index_tables=(), snapshot_dir=None, join_tables=(),
+    binned_tables=(), sweep_tables=(), bloom_file=None):
+
+    args = []
+    for step in PIPELINE:
+        step_args = dict(step['args'])
+        if ('table' in step_args):
+            step_args['binned_tables'] = frozenset(binned_tables)
+        if (step.get('filter') is not None) and (bloom_file is not None):
+            step_args[step['filter']] = bf.getBloomFilter(bloom_file)
+        for name, spec in step.get('indexes', {}).items():
+            if (spec['table'] in sweep_tables) and ('load' not in spec):
+                index = ii.SweepIndex(spec['table'], **getIndexColumns(spec))
+                if spec.get('memoize'):
+                    index = ii.MemoizedIndex(index)
+                step_args[name] = index
+                continue
+            if (spec['table'] not in index_tables):
+                if (spec['table'] in join_tables) and ('load' not in spec):
+                    step_args[name] = ann.OverlapJoin(spec['table'], 
+                        key=spec.get('key', 'chrom'), **getIndexColumns(spec))
+                continue
+            load = spec.get('load', ii.getTableIndex)
+            index = load(cursor, spec['table'], snapshot_dir=snapshot_dir, 
+                **getIndexColumns(spec))
+            if spec.get('memoize'):
+                index = ii.MemoizedIndex(index)
+            step_args[name] = index
+        args.append(step_args)
+
+    return args
+
+
+"""Releases the database connections held by the step arguments
+"""
+def closeStepArgs(args):
+    for step_args in args:
+        for value in step_args.values():
+            if isinstance(value, ii.MemoizedIndex):
+                value = value.index
+            if isinstance(value, ii.SweepIndex):
+                value.close()
+
+
+"""Tells whether the data lines of a VCF are sorted by position: every 
+   chromosome in one run, positions not decreasing within it
+"""
+def isSortedInput(lines, inds):
+    seen = set()
+    chrom = None
+    pos = None
+    for line in lines:
+        if ann.isCommentLine(line):
+            continue
+        record = ann.VariantRecord(line.split('\t'), inds)
+        if not record.pos.isdigit():
+            return False
+        if (record.chrom.upper() != chrom):
+            if (record.chrom.upper() in seen):
+                return False
+            chrom = record.chrom.upper()
+            seen.add(chrom)
+        elif (int(record.pos) < pos):
+            return False
+        pos = int(record.pos)
+
+    return True
+
+
+"""Data lines in a VCF and, unless sorted_input says so already, whether
+   they are sorted by position
+"""
+def getInputStats(path, inds, sorted_input=False):
+    fh = open(path)
+    variants = sum(1 for line in fh if not ann.isCommentLine(line.strip()))
+    if not sorted_input:
+        fh.seek(0)
+        sorted_input = isSortedInput((line.strip() for line in fh), inds)
+    fh.close()
+
+    return (variants, sorted_input)
+
+
+"""Picks the lookup plan of every indexed table and of dbSNP for the job in
+   path with planner.planLookups, from the server's table statistics, the
+   job's variants and memory_limit bytes or, when None, a share of the 
+   memory available
+   Returns the plans and the variants they were made for
+"""
+def planJob(path, inds, sorted_input, batch_size, workers, depth, 
+    snapshot_dir, memory_limit=None, bloom_file=None):
+
+    variants, sorted_input = getInputStats(path, inds, sorted_input)
+    conn = u.db_connect()
+    cursor = conn.cursor()
+    stats = pl.getTableStats(cursor, [t for spec in 
+        pl.getIndexSpecs(PIPELINE) for t in pl.getSpecTables(spec)] + 
+        [step['table'] for step in pl.getBatchSteps(PIPELINE)])
+    cursor.close()
+    conn.close()
+
+    if (memory_limit is None):
+        available = pl.getAvailableMemory()
+        if (available is not None):
+            memory_limit = int(available * pl.PLAN_MEMORY_SHARE)
+
+    plans = pl.planLookups(PIPELINE, stats, variants, sorted_input, 
+        batch_size, workers, depth, snapshot_dir, memory_limit, bloom_file)
+    return (plans, variants)
+
+
+"""Applies every pipeline step to one VariantRecord, in place
+   counts holds one Counter per step, args the arguments of each step and
+   lookups the prefetched chunk (or None) per step
+"""
+def annotateRecord(cursor, record, counts, args, lookups):
+    last = len(PIPELINE) - 1
+
+    for i, step in enumerate(PIPELINE):
+        if (lookups[i] is not None):
+            step['annotate'](cursor, record, counts[i], lookup=lookups[i], 
+                **args[i])
+        else:
+            step['annotate'](cursor, record, counts[i], **args[i])
+
+        # Each step used to re-read the previous step's file with 
+        # line.strip(), which only matters if the last field now ends 
+        # in whitespace
+        if (i < last) and record.endsInSpace():
+            record.setFields(record.getLine().strip().split('\t'))
+
+
+# Records read per lookup in flight when not batching, so every thread of a
+# RecordPipeline has work for the whole chunk
+PIPELINE_READ_AHEAD = 4
+
+
+"""Annotates records on a pool of depth threads, each over a pooled
+   connection of its own, so up to depth records have lookups in flight at
+   once instead of one; records are still written in input order
+   The steps only read their arguments, so the threads share them; not
+   for SweepIndexes, which must see the records in order
+"""
+class RecordPipeline(object):
+    def __init__(self, depth):
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=depth)
+        self.local = threading.local()
+        self.conns = []
+        self.lock = threading.Lock()
+
+    """The calling thread's cursor, opened on its first record
+    """
+    def cursor(self):
+        if not hasattr(self.local, 'cursor'):
+            conn = u.db_connect()
+            with self.lock:
+                self.conns.append(conn)
+            self.local.cursor = conn.cursor()
+        return self.local.cursor
+
+    def annotateOne(self, record, counts, args, lookups):
+        annotateRecord(self.cursor(), record, counts, args, lookups)
+
+    """Annotates (record, counts) pairs in place and waits for all
+    """
+    def annotate(self, records, args, lookups):
+        futures = [self.executor.submit(self.annotateOne, record, 
+            record_counts, args, lookups) 
+            for record, record_counts in records]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.executor.shutdown()
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
+
+
+"""RecordPipeline of depth threads, or None for one record at a time
+"""
+def getRecordPipeline(depth=None):
+    if (depth is None) or (depth < 2):
+        return None
+    return RecordPipeline(depth)
+
+
+"""Records annotateLines is given at a time
+"""
+def getChunkSize(batch_size, depth=None):
+    if (batch_size is not None):
+        return batch_size
+    if (depth is not None) and (depth > 1):
+        return depth * PIPELINE_READ_AHEAD
+    return 1
+
+
+"""Annotates a chunk of stripped VCF lines and returns them annotated
+   With batched set, steps that have a prefetch resolve the chunk with it
+   OverlapJoins among args are loaded with the chunk's positions first
+   With a VariantCache, records seen by earlier jobs are annotated from it,
+   the others are added to it, and both are counted in cache_counts
+   With a RecordPipeline, the records are annotated concurrently on it
+   exact_info makes INFO entries match by exact name (VariantRecord)
+"""
+def annotateLines(cursor, lines, inds, counts, args, batched=False, 
+    cache=None, cache_counts=None, pipeline=None, exact_info=False):
+
+    chunk = []
+    for line in lines:
+        if ann.isCommentLine(line):
+            chunk.append((line, None))
+        else:
+            record = ann.VariantRecord(line.split('\t'), inds, exact_info)
+            key = None
+            if (cache is not None):
+                context = vc.getRecordContext(record)
+                if (context is not None):
+                    key = vc.getCacheKey(record, context)
+            chunk.append((record, key))
+
+    hits = {}
+    if (cache is not None):
+        hits = cache.getMany([key for record, key in chunk 
+            if key is not None])
 
-def run(infile, format):
+    misses = [(record, key) for record, key in chunk 
+        if isinstance(record, ann.VariantRecord) and (key not in hits)]
+    records = [record for record, key in misses]
+    joins = [a for step_args in args for a in step_args.values() 
+        if isinstance(a, ann.OverlapJoin)]
+    if (len(joins) > 0) and (len(records) > 0):
+        ann.loadJoins(cursor, records, joins)
+
+    lookups = [None for step in PIPELINE]
+    if batched:
+        for i, step in enumerate(PIPELINE):
+            if (step.get('prefetch') is not None):
+                lookups[i] = step['prefetch'](cursor, records, **args[i])
+
+    # Records get counters of their own when they are cached or annotated
+    # concurrently, and are added into counts after
+    befores = [list(record.fields) for record in records] \
+        if (cache is not None) else None
+    record_counts = [[Counter() for step in PIPELINE] for record in records] \
+        if (cache is not None) or (pipeline is not None) else None
+
+    if (pipeline is not None):
+        pipeline.annotate(list(zip(records, record_counts)), args, lookups)
+    else:
+        for i, record in enumerate(records):
+            annotateRecord(cursor, record, counts if 
+                (record_counts is None) else record_counts[i], args, lookups)
+
+    if (record_counts is not None):
+        for more_counts in record_counts:
+            for step_counts, more in zip(counts, more_counts):
+                step_counts.update(more)
+
+    if (cache is not None):
+        cache_counts['misses'] = cache_counts['misses'] + len(misses)
+        entries = {}
+        for (record, key), before, more_counts in zip(misses, befores, 
+            record_counts):
+            if (key is not None):
+                entry = vc.getEntry(before, record.getFields(), more_counts)
+                if (entry is not None):
+                    entries[key] = entry
+        if (len(entries) > 0):
+            cache.putMany(entries)
+
+    out = []
+    for record, key in chunk:
+        if not isinstance(record, ann.VariantRecord):
+            out.append(record)
+        elif (key in hits):
+            out.append('\t'.join(vc.applyEntry(record.fields, hits[key])))
+            for step_counts, more in zip(counts, hits[key]['counts']):
+                step_counts.update(more)
+            cache_counts['hits'] = cache_counts['hits'] + 1
+        else:
+            out.append(record.getLine())
+
+    return out
+
+
+"""Writes the count log sections of every step, in pipeline order, then
+   the variant cache's hits and misses when there was one
+"""
+def writeCountLog(logcountfile, counts, cache_counts=None, plans=None,
+    variants=None):
+    fh_log = open(logcountfile, 'w')
+    for step, step_counts in zip(PIPELINE, counts):
+        if (step['log'] is not None):
+            step['log'](fh_log, step_counts, **step['args'])
+    if (cache_counts is not None):
+        fh_log.write(f"Variant cache: {str(cache_counts['hits'])} hits, " + \
+            f"{str(cache_counts['misses'])} misses\n")
+    if (plans is not None):
+        pl.writePlanLog(fh_log, plans, variants)
+    fh_log.close()
+
+
+"""Version the variant cache is kept under: the reference database version
+   plus a digest of the pipeline and of exact_info, so changing any of them
+   invalidates the cache
+"""
+def getCacheVersion(reference_version, exact_info=False):
+    steps = [(step['name'], sorted(step['args'].items())) 
+        for step in PIPELINE] + [('exact_info', exact_info)]
+    digest = hashlib.sha1(repr(steps).encode('utf-8')).hexdigest()
+    return str(reference_version) + ':' + digest[:12]
+
+
+"""Splits the data lines of a VCF into shards of (line number, line):
+   one per chromosome, cut into pieces of at most shard_size lines so a 
+   skewed input still spreads across workers
+"""
+def shardLines(lines, shard_size=None):
+    shards = []
+    current = {}
+    for n, line in enumerate(lines):
+        if ann.isCommentLine(line):
+            continue
+        chrom = line.split('\t', 1)[0].strip()
+        if (chrom not in current) or \
+            ((shard_size is not None) and (len(current[chrom]) >= shard_size)):
+            current[chrom] = []
+            shards.append(current[chrom])
+        current[chrom].append((n, line))
+
+    return shards
+
+
+"""Annotates one shard in a pool worker, over the worker's own connection
+   (and variant cache connection, with cache_file)
+   Returns the shard's line numbers, annotated lines, step counters and 
+   cache counters
+"""
+def annotateShard(shard, format, batch_size, index_tables, snapshot_dir,
+    join_tables=(), binned_tables=(), sweep_tables=(), cache_file=None, 
+    cache_version=None, bloom_file=None, depth=None, exact_info=False,
+    batched=None):
+
+    inds = ann.getFormatSpecificIndices(format=format)
+    counts = [Counter() for step in PIPELINE]
+    cache_counts = Counter()
+    conn = u.db_connect()
+    cursor = conn.cursor()
+    args = getStepArgs(cursor, index_tables, snapshot_dir, join_tables,
+        binned_tables, sweep_tables, bloom_file)
+    cache = None
+    if (cache_file is not None):
+        cache = vc.VariantCache(cache_file, cache_version)
+
+    pipeline = getRecordPipeline(depth)
+
+    lines = [line for n, line in shard]
+    size = getChunkSize(batch_size, depth)
+    out = []
+    for i in range(0, len(lines), size):
+        out.extend(annotateLines(cursor, lines[i:i + size], inds, counts, 
+            args, batched=(batch_size is not None) if (batched is None) 
+            else batched, cache=cache, 
+            cache_counts=cache_counts, pipeline=pipeline, 
+            exact_info=exact_info))
+
+    if (pipeline is not None):
+        pipeline.close()
+    if (cache is not None):
+        cache.close()
+    closeStepArgs(args)
+    conn.close()
+    return [n for n, line in shard], out, counts, cache_counts
+
+
+"""Annotates the data lines of a VCF across a pool of worker processes and
+   returns them annotated in their original order, adding each shard's 
+   step counters into counts and cache counters into cache_counts
+"""
+def annotateParallel(lines, format, counts, workers, shard_size=None, 
+    batch_size=None, index_tables=(), snapshot_dir=None, join_tables=(),
+    binned_tables=(), sweep_tables=(), cache_file=None, cache_version=None,
+    cache_counts=None, bloom_file=None, depth=None, exact_info=False,
+    batched=None):
+
+    out = list(lines)
+    shards = shardLines(lines, shard_size)
+    # Largest shards first, so the stragglers are the small ones
+    shards.sort(key=len, reverse=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(annotateShard, shard, format, batch_size,
+            index_tables, snapshot_dir, join_tables, binned_tables, 
+            sweep_tables, cache_file, cache_version, bloom_file, depth, 
+            exact_info, batched)
+            for shard in shards]
+        for future in futures:
+            line_numbers, annotated, shard_counts, shard_cache_counts = \
+                future.result()
+            for n, line in zip(line_numbers, annotated):
+                out[n] = line
+            for step_counts, more in zip(counts, shard_counts):
+                step_counts.update(more)
+            if (cache_counts is not None):
+                cache_counts.update(shard_cache_counts)
+
+    return out
+
+
+"""Annotates infile in a single pass: every record is parsed once, run 
+   through all PIPELINE steps in memory and written once
+   With batch_size, records are processed batch_size at a time and batched 
+   lookups (dbSNP) take one round trip per chunk instead of per variant
+   Tables named in index_tables are loaded once per worker into an interval
+   index and overlaps with them are resolved without the database; with 
+   snapshot_dir, indexes are mapped from the snapshots exported there
+   Tables named in join_tables are resolved for a whole chunk at a time by
+   a range join on the server instead (best with batch_size)
+   Queries on tables named in binned_tables also filter on the UCSC bin
+   Tables named in sweep_tables are merged with position-sorted input in a
+   sweep line; for unsorted input they are indexed instead
+   With sort_memory, infile is first sorted by position in at most that
+   many bytes (vcf_sort) and annotated sorted; with restore_order the
+   annotated file is put back in upload order at the end
+   With bloom_file, a Bloom filter of dbSNP built by bloom_filter.py, 
+   variants it rules out are not looked up in dbSNP
+   With workers > 1, the input is sharded by chromosome (shards of at most 
+   shard_size records) and annotated by a pool of that many processes
+   With exact_info, steps reading INFO entries (positionType) match their
+   names exactly, not by substring as the pipeline always has
+   With depth > 1, each process annotates that many records at a time on
+   as many threads and connections, except alongside swept tables
+   With cache_file, records are annotated from and added to the persistent
+   variant cache there, kept for reference_version and trimmed to 
+   cache_size entries
+   With plan, index_tables, join_tables and sweep_tables are picked for the
+   job by planJob, indexing in at most plan_memory bytes, and so is whether
+   dbSNP is looked up a chunk at a time and behind the Bloom filter
+"""
+def run(infile, format, batch_size=None, index_tables=(), snapshot_dir=None,
+    workers=1, shard_size=None, cache_file=None, cache_size=None, 
+    reference_version=None, join_tables=(), binned_tables=(), 
+    sweep_tables=(), sort_memory=None, restore_order=False, bloom_file=None,
+    depth=None, exact_info=False, plan=False, plan_memory=None):
 
     print("Running . . .")
 
-    ann.getSnpsFromDbSnp(vcf=infile, format='vcf', tmpextin='', 
-        tmpextout='.1')
-    print("dbSNP - done.")
-    tmpextin = 1
-    tmpextout = 2
-
-    ann.getBigRefGene(vcf=infile, format='vcf', tmpextin='.' + str(tmpextin),
-        tmpextout='.' + str(tmpextout))
-    print("BigRefGene - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.getGenes(vcf=infile, format='vcf', table='refGene', 
-        promoter_offset=500, tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("BigRefGene - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCytoband(vcf=infile, format='vcf', table='cytoBand', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("Cytoband - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGadAll(vcf=infile, format='vcf', table='gadAll', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("gadAll - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGwasCatalog(vcf=infile, format='vcf', 
-        table='gwasCatalog', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("GwasCatalog - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithMiRNA(vcf=infile, format='vcf', table='targetScanS', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("miRNA - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWitHUGOGeneNomenclature(vcf=infile, format='vcf', 
-        table='hugo', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("HUGO Gene Nomenclature Committee - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', table='dgv_Cnv', 
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("dgv_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', 
-        table='abParts_IG_T_CelReceptors', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("abParts_IG_T_CelReceptors - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', 
-        table='mcCarroll_Cnv', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("mcCarroll_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithCnvDatabase(vcf=infile, format='vcf', 
-        table='conrad_Cnv', tmpextin='.' + str(tmpextin), 
-        tmpextout='.' + str(tmpextout))
-    print("conrad_Cnv - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithGenomicSuperDups(vcf=infile, format='vcf', 
-        table='genomicSuperDups', tmpextin='.' + str(tmpextin),
-        tmpextout='.' + str(tmpextout))
-    print("genomicSuperDups - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ann.addOverlapWithTfbsConsSites(vcf=infile, table='tfbsConsSites',
-        tmpextin='.' + str(tmpextin), tmpextout='.' + str(tmpextout))
-    print("addOverlapWithTfbsConsSites - done.")
-    tmpextin = tmpextin + 1
-    tmpextout = tmpextout + 1
-
-    ## Cleanup
-    for i in range(1, tmpextin):
-        fu.delete(infile + '.' + str(i))
-
-    os.rename(infile + '.' + str(tmpextin), infile + '.annot')
-    finalout=(infile + '.annot').replace('.vcf.annot', '.annot.vcf')
-    os.rename(infile + '.annot', finalout)
+    inds = ann.getFormatSpecificIndices(format=format)
+    counts = [Counter() for step in PIPELINE]
+    tmpout = infile + '.annot'
+
+    cache = None
+    cache_counts = None
+    cache_version = None
+    if (cache_file is not None):
+        cache_version = getCacheVersion(reference_version, exact_info)
+        cache = vc.VariantCache(cache_file, cache_version, cache_size)
+        cache_counts = Counter()
+
+    source = infile
+    if (sort_memory is not None):
+        source = infile + '.sorted'
+        vs.sortVcf(infile, source, infile + '.order', sort_memory)
+
+    plans = None
+    variants = None
+    batched = (batch_size is not None)
+    if plan:
+        plans, variants = planJob(source, inds, (source != infile), 
+            batch_size, workers, depth, snapshot_dir, plan_memory, bloom_file)
+        index_tables = [p['table'] for p in plans if (p['plan'] == 'index')]
+        join_tables = [p['table'] for p in plans if (p['plan'] == 'join')]
+        sweep_tables = [p['table'] for p in plans if (p['plan'] == 'sweep')]
+        lookups = [p['plan'] for p in plans if p['table'] in 
+            [step['table'] for step in pl.getBatchSteps(PIPELINE)]]
+        batched = batched and any([p.endswith('batch') for p in lookups])
+        if not any([p.startswith('bloom') for p in lookups]):
+            bloom_file = None
+
+    if (len(sweep_tables) > 0) and (source == infile) and not plan:
+        fh = open(infile)
+        if not isSortedInput((line.strip() for line in fh), inds):
+            print("Input is not sorted by position, indexing swept tables")
+            index_tables = list(index_tables) + list(sweep_tables)
+            sweep_tables = ()
+        fh.close()
+
+    if (len(sweep_tables) > 0) and (depth is not None) and (depth > 1):
+        print("Swept tables need records in order, annotating one at a time")
+        depth = None
+
+    fh = open(source)
+    fh_out = open(tmpout, 'w')
+
+    if (workers > 1):
+        lines = [line.strip() for line in fh]
+        for line in annotateParallel(lines, format, counts, workers, 
+            shard_size, batch_size, index_tables, snapshot_dir, join_tables,
+            binned_tables, sweep_tables, cache_file, cache_version, 
+            cache_counts, bloom_file, depth, exact_info, batched):
+            fh_out.write(line + '\n')
+
+    else:
+        conn = u.db_connect()
+        cursor = conn.cursor()
+        args = getStepArgs(cursor, index_tables, snapshot_dir, join_tables,
+            binned_tables, sweep_tables, bloom_file)
+        pipeline = getRecordPipeline(depth)
+
+        for lines in fu.readChunks(fh, getChunkSize(batch_size, depth)):
+            for line in annotateLines(cursor, lines, inds, counts, args,
+                batched=batched, cache=cache, 
+                cache_counts=cache_counts, pipeline=pipeline, 
+                exact_info=exact_info):
+                fh_out.write(line + '\n')
+
+        if (pipeline is not None):
+            pipeline.close()
+        closeStepArgs(args)
+        conn.close()
+
+    fh.close()
+    fh_out.close()
+
+    if (cache is not None):
+        cache.evict()
+        cache.close()
+
+    if (source != infile):
+        if restore_order:
+            vs.restoreOrder(tmpout, infile + '.order', tmpout + '.restored',
+                sort_memory)
+            os.replace(tmpout + '.restored', tmpout)
+        fu.delete(source)
+        fu.delete(infile + '.order')
+
+    writeCountLog(infile + '.count.log', counts, cache_counts, plans, 
+        variants)
+    for step in PIPELINE:
+        print(f"{step['name']} - done.")
+
+    finalout = tmpout.replace('.vcf.annot', '.annot.vcf')
+    os.rename(tmpout, finalout)
 
 ### EOF
\ No newline at end of file
@@ -0,0 +1,50 @@
+# export_snapshots.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Exports the indexed reference tables to memory-mapped snapshot files
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import sys
+import os
+
+import driver
+import interval_index as ii
+import utils as u
+
+"""Exports every pipeline table that can be served from an interval index,
+   or just the ones named in tables, into snapshot_dir
+"""
+def export(snapshot_dir, tables=None):
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+
+    conn = u.db_connect()
+    cursor = conn.cursor()
+
+    exported = set()
+    for step in driver.PIPELINE:
+        for spec in step.get('indexes', {}).values():
+            table = spec['table']
+            if (table in exported) or (tables and (table not in tables)):
+                continue
+
+            index = ii.loadTableIndex(cursor, table, 
+                stored=('load' not in spec), **driver.getIndexColumns(spec))
+            ii.writeSnapshot(index, ii.snapshotPath(snapshot_dir, table))
+            exported.add(table)
+            print(f"{table} - exported {len(index.rows)} rows")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        export(sys.argv[1], sys.argv[2:])
+    else:
+        print("Usage: export_snapshots.py <snapshot_dir> [table ...]")
+
+### EOF
@@ -228,6 +228,19 @@ def linecount(filename):
     return linenum
 
 
+"""Reads an open file in chunks of up to size stripped lines
+"""
+def readChunks(fh, size):
+    lines = []
+    for line in fh:
+        lines.append(line.strip())
+        if (len(lines) >= size):
+            yield lines
+            lines = []
+    if (len(lines) > 0):
+        yield lines
+
+
 """Saves list of rows and columns in a text file
 """
 def save2txt(read_data, txtfile, compress=False, debug=True):
@@ -0,0 +1,493 @@
+# interval_index.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# In-memory interval index over the annotator reference tables
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import array
+import bisect
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+
+import utils as u
+
+"""Reference tables already indexed by this worker, keyed by table name
+"""
+INDEXES = {}
+
+# Snapshots written before hits were kept in storage order are not read
+SNAPSHOT_MAGIC = b'ANNSNAP2'
+
+
+"""Sort key of a table's rows in the order UCSC tables are stored in and
+   per-variant queries return them over their (chrom, bin) keys: by bin,
+   where the table has one, then by interval
+   The interval index, the overlap join and the sweep all give the hits of
+   a position in this order, so first-hit tables get the same first hit
+   whichever way they are looked up; rows equal on all three keep the
+   order they were read in
+"""
+def getStorageKey(columns, start='chromStart', end='chromEnd'):
+    lower = [c.lower() for c in columns]
+    inds = [lower.index(start.lower()), lower.index(end.lower())]
+    if ('bin' in lower):
+        inds.insert(0, lower.index('bin'))
+    return lambda row: tuple([int(row[i] or 0) for i in inds])
+
+
+"""Nested containment list of closed intervals, one per chromosome
+   Finds every interval holding a position in O(log n + k); hits come back
+   in the order the intervals were added
+
+   The lists are stored flat: every sublist is a contiguous run of the
+   starts/ends/ids arrays, and sub_starts/sub_lens point each interval at
+   the sublist of intervals it contains. Siblings never contain each other,
+   so both their starts and their ends are increasing.
+"""
+class IntervalIndex(object):
+    def __init__(self):
+        self.intervals = {}
+        self.rows = []
+        self.columns = []
+        self.chroms = {}
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self.ids = array.array('q')
+        self.sub_starts = array.array('q')
+        self.sub_lens = array.array('q')
+
+    def add(self, chrom, start, end, row):
+        self.intervals.setdefault(str(chrom).upper(), []).append(
+            (int(start), int(end), len(self.rows)))
+        self.rows.append(row)
+
+    """Builds the containment lists; call once all intervals are added
+    """
+    def build(self):
+        for chrom in sorted(self.intervals):
+            intervals = self.intervals[chrom]
+            intervals.sort(key=lambda x: (x[0], -x[1]))
+
+            # Nested lists first, each one [starts, ends, ids, children]
+            lists = [[[], [], [], []]]
+            stack = []
+            for start, end, id in intervals:
+                while (len(stack) > 0) and (stack[-1][0] < end):
+                    stack.pop()
+
+                if (len(stack) > 0):
+                    parent = lists[stack[-1][1]]
+                    j = stack[-1][2]
+                    if (parent[3][j] < 0):
+                        parent[3][j] = len(lists)
+                        lists.append([[], [], [], []])
+                    sublist = parent[3][j]
+                else:
+                    sublist = 0
+
+                l = lists[sublist]
+                l[0].append(start)
+                l[1].append(end)
+                l[2].append(id)
+                l[3].append(-1)
+                stack.append((end, sublist, len(l[2]) - 1))
+
+            # Then laid out one after the other
+            offsets = []
+            total = len(self.starts)
+            for l in lists:
+                offsets.append(total)
+                total = total + len(l[0])
+
+            for l in lists:
+                self.starts.extend(l[0])
+                self.ends.extend(l[1])
+                self.ids.extend(l[2])
+                for child in l[3]:
+                    if (child >= 0):
+                        self.sub_starts.append(offsets[child])
+                        self.sub_lens.append(len(lists[child][0]))
+                    else:
+                        self.sub_starts.append(0)
+                        self.sub_lens.append(0)
+
+            self.chroms[chrom] = (offsets[0], len(lists[0][0]))
+
+        self.intervals = {}
+
+    def findIds(self, chrom, pos):
+        root = self.chroms.get(str(chrom).upper())
+        if (root is None):
+            return []
+
+        pos = int(pos)
+        starts = self.starts
+        ends = self.ends
+        ids = []
+        pending = [root]
+        while (len(pending) > 0):
+            offset, count = pending.pop()
+            last = offset + count
+            j = bisect.bisect_left(ends, pos, offset, last)
+            while (j < last) and (starts[j] <= pos):
+                ids.append(self.ids[j])
+                if (self.sub_lens[j] > 0):
+                    pending.append((self.sub_starts[j], self.sub_lens[j]))
+                j = j + 1
+
+        return sorted(ids)
+
+    def row(self, id):
+        return self.rows[id]
+
+    """All rows whose interval holds pos, in the order they were added
+    """
+    def find(self, chrom, pos):
+        return [self.row(id) for id in self.findIds(chrom, pos)]
+
+    """First row added whose interval holds pos, or None
+    """
+    def first(self, chrom, pos):
+        ids = self.findIds(chrom, pos)
+        if (len(ids) > 0):
+            return self.row(ids[0])
+        return None
+
+    """Position of a named column in the rows, ignoring case
+    """
+    def column(self, name):
+        return [c.lower() for c in self.columns].index(name.lower())
+
+
+"""Wraps an index for the length of one job and remembers every position
+   already looked up with first(), so repeated probes of the same position
+   (e.g. overlapping transcripts sharing a promoter) are answered from a dict
+"""
+class MemoizedIndex(object):
+    def __init__(self, index):
+        self.index = index
+        self.columns = index.columns
+        self.memo = {}
+
+    def column(self, name):
+        return self.index.column(name)
+
+    def find(self, chrom, pos):
+        return self.index.find(chrom, pos)
+
+    def first(self, chrom, pos):
+        key = (str(chrom).upper(), int(pos))
+        if key not in self.memo:
+            self.memo[key] = self.index.first(chrom, pos)
+        return self.memo[key]
+
+
+"""Resolves positions against the three bigRefGene tables with one probe
+   A hash on (chromosome, start) holds the rows of both equal tables, each
+   base row with its alleles; only positions missing from both fall through
+   to the interval index of the unequal table
+"""
+class BigRefGeneIndex(object):
+    def __init__(self, unequal):
+        self.equal = {}
+        self.unequal = unequal
+
+    def add(self, chrom, start, row, alleles=None):
+        key = (str(chrom).upper(), int(start))
+        base, nobase = self.equal.setdefault(key, ([], []))
+        if (alleles is not None):
+            base.append((alleles, row))
+        else:
+            nobase.append(row)
+
+    """Rows of the first table with a hit, in table order: base rows whose
+       (ref, alt) is one of alleles, then nobase rows, then unequal rows
+       holding pos
+    """
+    def resolve(self, chrom, pos, alleles):
+        hit = self.equal.get((str(chrom).upper(), int(pos)))
+        if (hit is not None):
+            alleles = [(str(r).upper(), str(a).upper()) for r, a in alleles]
+            rows = [row for pair, row in hit[0] if pair in alleles]
+            if (len(rows) > 0):
+                return rows
+            if (len(hit[1]) > 0):
+                return hit[1]
+        return self.unequal.find(chrom, pos)
+
+
+"""Sweep line over a reference table for position-sorted input
+   Each chromosome of the table is streamed in start order over an 
+   unbuffered cursor of its own connection, next to the records; only the 
+   intervals holding the current position are kept, in a heap by end, so
+   memory is bounded by the overlap depth instead of the table size
+   A position before the previous one, or a chromosome seen before, 
+   restarts the stream from that position, so unsorted input is still 
+   answered correctly, only slowly. Hits come in storage order 
+   (getStorageKey), like those of the index, not in stream order
+"""
+class SweepIndex(object):
+    def __init__(self, table, chrom='chrom', start='chromStart', 
+        end='chromEnd'):
+
+        self.table = table
+        self.chrom_col = chrom
+        self.start_col = start
+        self.end_col = end
+        self.columns = []
+        self.conn = None
+        self.cursor = None
+        self.chrom = None
+        self.pos = None
+        self.active = []
+        self.pending = None
+        self.seq = 0
+
+    """Streams the intervals of chrom that end at or after pos
+    """
+    def open(self, chrom, pos):
+        if (self.conn is None):
+            self.conn = u.db_connect()
+        if (self.cursor is not None):
+            self.cursor.close()
+
+        self.cursor = self.conn.cursor(unbuffered=True)
+        self.cursor.execute('select * from ' + self.table + ' where ' +
+            self.chrom_col + '="' + str(chrom) + '" AND ' + self.start_col +
+            ' IS NOT NULL AND ' + self.end_col + ' >= ' + str(pos) +
+            ' order by ' + self.start_col + ', ' + self.end_col + ';')
+        self.columns = [str(c[0]) for c in self.cursor.description]
+        lower = [c.lower() for c in self.columns]
+        self.start_ind = lower.index(self.start_col.lower())
+        self.end_ind = lower.index(self.end_col.lower())
+        self.key = getStorageKey(self.columns, self.start_col, self.end_col)
+
+        self.chrom = str(chrom).upper()
+        self.active = []
+        self.seq = 0
+        self.pending = self.cursor.fetchone()
+
+    """Moves the sweep line to pos: starts every interval beginning at or
+       before it and retires those ending before it
+    """
+    def advance(self, chrom, pos):
+        if (str(chrom).upper() != self.chrom) or (pos < self.pos):
+            self.open(chrom, pos)
+        self.pos = pos
+
+        while (self.pending is not None) and \
+            (int(self.pending[self.start_ind]) <= pos):
+            heapq.heappush(self.active, 
+                (int(self.pending[self.end_ind]), self.seq, self.pending))
+            self.seq = self.seq + 1
+            self.pending = self.cursor.fetchone()
+
+        while (len(self.active) > 0) and (self.active[0][0] < pos):
+            heapq.heappop(self.active)
+
+    def find(self, chrom, pos):
+        self.advance(chrom, int(pos))
+        return [row for end, seq, row in 
+            sorted(self.active, key=lambda x: (self.key(x[2]), x[1]))]
+
+    def first(self, chrom, pos):
+        rows = self.find(chrom, pos)
+        if (len(rows) > 0):
+            return rows[0]
+        return None
+
+    def column(self, name):
+        return [c.lower() for c in self.columns].index(name.lower())
+
+    def close(self):
+        if (self.cursor is not None):
+            self.cursor.close()
+            self.cursor = None
+        if (self.conn is not None):
+            self.conn.close()
+            self.conn = None
+
+
+"""An IntervalIndex read straight from a snapshot file with mmap
+   Nothing is copied at open; rows are decoded from the string heap as they
+   are hit, and every column comes back as the string the exporter wrote
+"""
+class SnapshotIndex(IntervalIndex):
+    def __init__(self, path):
+        IntervalIndex.__init__(self)
+
+        fh = open(path, 'rb')
+        self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        fh.close()
+
+        if (self.mm[0:8] != SNAPSHOT_MAGIC):
+            raise ValueError(f"{path} is not an annotator snapshot")
+        header_len = struct.unpack('<Q', self.mm[8:16])[0]
+        header = json.loads(self.mm[16:16 + header_len].decode('utf-8'))
+        if (header['byteorder'] != sys.byteorder):
+            raise ValueError(f"{path} was written on a {header['byteorder']}" +
+                "-endian host")
+
+        self.columns = header['columns']
+        self.chroms = dict([(c, tuple(v)) for c, v in header['chroms'].items()])
+        self.ncols = len(self.columns)
+
+        view = memoryview(self.mm)
+        offset = snapshotAlign(16 + header_len)
+        arrays = []
+        for count in [header['intervals']] * 5 + \
+            [header['rows'] * self.ncols + 1]:
+            arrays.append(view[offset:offset + 8 * count].cast('q'))
+            offset = offset + 8 * count
+
+        (self.starts, self.ends, self.ids, self.sub_starts, self.sub_lens,
+            self.heap_offsets) = arrays
+        self.heap_start = offset
+
+    def row(self, id):
+        base = id * self.ncols
+        row = []
+        for i in range(base, base + self.ncols):
+            value = self.mm[self.heap_start + self.heap_offsets[i]:
+                self.heap_start + self.heap_offsets[i + 1]]
+            row.append(value.decode('utf-8', 'surrogateescape'))
+        return tuple(row)
+
+
+def snapshotAlign(offset):
+    return (offset + 7) & ~7
+
+
+def snapshotPath(snapshot_dir, table):
+    return os.path.join(snapshot_dir, table + '.snap')
+
+
+"""Writes an IntervalIndex to a snapshot file:
+   magic, header length, JSON header, then 8-byte aligned int64 arrays
+   (starts, ends, ids, sub_starts, sub_lens, heap offsets) and the string
+   heap holding str() of every column of every row
+   The file is replaced atomically so running workers keep their old copy
+"""
+def writeSnapshot(index, path):
+    heap = bytearray()
+    heap_offsets = array.array('q', [0])
+    for row in index.rows:
+        for value in row:
+            heap.extend(str(value).encode('utf-8', 'surrogateescape'))
+            heap_offsets.append(len(heap))
+
+    header = json.dumps({'columns': index.columns, 'rows': len(index.rows),
+        'intervals': len(index.starts), 'chroms': index.chroms,
+        'byteorder': sys.byteorder}).encode('utf-8')
+
+    tmppath = path + '.tmp'
+    fh = open(tmppath, 'wb')
+    fh.write(SNAPSHOT_MAGIC)
+    fh.write(struct.pack('<Q', len(header)))
+    fh.write(header)
+    fh.write(b'\0' * (snapshotAlign(16 + len(header)) - 16 - len(header)))
+    for a in (index.starts, index.ends, index.ids, index.sub_starts,
+        index.sub_lens, heap_offsets):
+        fh.write(a.tobytes())
+    fh.write(heap)
+    fh.close()
+    os.replace(tmppath, path)
+
+
+"""Reads a whole reference table into an IntervalIndex
+   chrom, start and end name the columns holding each closed interval
+   Rows are added in storage order (getStorageKey) or, unless stored, in
+   the order the table is read in
+"""
+def loadTableIndex(cursor, table, chrom='chrom', start='chromStart',
+    end='chromEnd', stored=True):
+
+    cursor.execute('select * from ' + table + ';')
+    columns = [str(c[0]) for c in cursor.description]
+    lower = [c.lower() for c in columns]
+    chrom_ind = lower.index(chrom.lower())
+    start_ind = lower.index(start.lower())
+    end_ind = lower.index(end.lower())
+
+    rows = [row for row in cursor.fetchall() 
+        if (row[start_ind] is not None) and (row[end_ind] is not None)]
+    if stored:
+        rows.sort(key=getStorageKey(columns, start, end))
+
+    index = IntervalIndex()
+    index.columns = columns
+    for row in rows:
+        index.add(row[chrom_ind], row[start_ind], row[end_ind], row)
+    index.build()
+
+    return index
+
+
+"""Loads the equal bigRefGene tables into a BigRefGeneIndex over the
+   interval index of the unequal one
+"""
+def loadBigRefGeneIndex(cursor, unequal, base='chrom_pos_equal_base', 
+    nobase='chrom_pos_equal_nobase', chrom='CHR', start='start'):
+
+    index = BigRefGeneIndex(unequal)
+    for table in (base, nobase):
+        cursor.execute('select * from ' + table + ';')
+        lower = [str(c[0]).lower() for c in cursor.description]
+        chrom_ind = lower.index(chrom.lower())
+        start_ind = lower.index(start.lower())
+        ref_ind = lower.index('haplotypereference')
+        alt_ind = lower.index('haplotypealternate')
+
+        for row in cursor.fetchall():
+            if (row[start_ind] is None):
+                continue
+            alleles = None
+            if (table == base):
+                alleles = (str(row[ref_ind]).upper(), 
+                    str(row[alt_ind]).upper())
+            index.add(row[chrom_ind], row[start_ind], row, alleles)
+
+    return index
+
+
+"""Returns the BigRefGeneIndex over table, the unequal bigRefGene table,
+   loading it on first use in this worker; the unequal table is mapped from
+   its snapshot when snapshot_dir holds one
+"""
+def getBigRefGeneIndex(cursor, table, snapshot_dir=None, **columns):
+    key = table + ':bigRefGene'
+    if key not in INDEXES:
+        unequal = getTableIndex(cursor, table, snapshot_dir=snapshot_dir, 
+            stored=False, **columns)
+        INDEXES[key] = loadBigRefGeneIndex(cursor, unequal, 
+            chrom=columns.get('chrom', 'CHR'), 
+            start=columns.get('start', 'start'))
+    return INDEXES[key]
+
+
+"""Returns the index of table, loading it on first use in this worker
+   A snapshot of the table in snapshot_dir is mapped instead of querying
+   the database, unless it is of an older format
+"""
+def getTableIndex(cursor, table, snapshot_dir=None, **columns):
+    if table not in INDEXES:
+        if (snapshot_dir is not None) and \
+            os.path.isfile(snapshotPath(snapshot_dir, table)):
+            try:
+                INDEXES[table] = SnapshotIndex(snapshotPath(snapshot_dir,
+                    table))
+            except ValueError as e:
+                print(f"{e}, loading {table} from the database")
+        if table not in INDEXES:
+            INDEXES[table] = loadTableIndex(cursor, table, **columns)
+    return INDEXES[table]
+
+### EOF
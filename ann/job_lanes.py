@@ -0,0 +1,147 @@
+# job_lanes.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Priority lanes of received annotation jobs, by user tier and input size,
+# dequeued weighted-fair with the smallest job of a lane first
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import heapq
+import itertools
+import time
+
+# Lanes and their weights when none are configured
+LANE_WEIGHTS = 'premium_small:8,premium_large:4,free_small:2,free_large:1'
+
+
+"""Lane weights from a "lane:weight,lane:weight" setting, in order
+"""
+def parseLaneWeights(text):
+    weights = []
+    for entry in text.split(','):
+        if entry.strip():
+            lane, weight = entry.split(':')
+            weights.append((lane.strip(), float(weight)))
+    return weights
+
+
+"""Lane request queues from a "lane:url,lane:url" setting, in order
+"""
+def parseLaneURLs(text):
+    urls = []
+    for entry in text.split(','):
+        if entry.strip():
+            lane, url = entry.split(':', 1)
+            urls.append((lane.strip(), url.strip()))
+    return urls
+
+
+"""Received jobs waiting for a worker, in one lane per tier and size
+   A job's lane is its tier (premium for premium users, free for everyone
+   else) and small or large, by whether its input is under size_threshold
+   bytes. Lanes are served by stride scheduling, a lane of weight w getting
+   w shares of the dequeues while it has jobs waiting, and each lane hands
+   out its smallest job first. A job that has waited max_wait seconds in
+   its lane goes ahead of everything, oldest first, so no lane or large job
+   starves; time spent on the request queue before does not count, or a
+   backlog there would make every job starved and the lanes plain FIFO
+   Waits are also recorded from submit_time, when the job was submitted,
+   where it has one
+"""
+class LaneScheduler(object):
+    def __init__(self, weights=None, size_threshold=0, max_wait=None):
+        self.weights = dict(weights or parseLaneWeights(LANE_WEIGHTS))
+        self.size_threshold = size_threshold
+        self.max_wait = max_wait
+        self.lanes = dict((lane, []) for lane in self.weights)
+        self.passes = dict((lane, 0.0) for lane in self.weights)
+        self.clock = 0.0
+        self.order = itertools.count()
+        self.waits = dict((lane, []) for lane in self.weights)
+
+    def __len__(self):
+        return sum([len(jobs) for jobs in self.lanes.values()])
+
+    def getLane(self, tier, size):
+        tier = 'premium' if (tier == 'premium_user') else 'free'
+        size = 'small' if (size < self.size_threshold) else 'large'
+        lane = tier + '_' + size
+        return lane if (lane in self.lanes) else min(self.weights,
+            key=lambda l: self.weights[l])
+
+    """Puts job, a dict with at least its tier, size and submit_time (or
+       None), in its lane; returns the lane
+    """
+    def put(self, job, now=None):
+        now = now if (now is not None) else time.time()
+        lane = self.getLane(job.get('tier'), job.get('size', 0))
+        job['lane'] = lane
+        job['entered'] = now
+        job['submitted'] = job['submit_time'] \
+            if (job.get('submit_time') is not None) else now
+        if (len(self.lanes[lane]) == 0):
+            # A lane gets no credit for the time it sat empty
+            self.passes[lane] = max(self.passes[lane], self.clock)
+        heapq.heappush(self.lanes[lane], (job.get('size', 0),
+            next(self.order), job))
+        return lane
+
+    def getStarved(self, now):
+        if (self.max_wait is None):
+            return None
+        oldest = None
+        for lane, jobs in self.lanes.items():
+            for size, n, job in jobs:
+                if (now - job['entered'] >= self.max_wait) and \
+                    ((oldest is None) or
+                    ((job['entered'], n) < (oldest[2]['entered'], oldest[1]))):
+                    oldest = (lane, n, job)
+        return oldest
+
+    """Takes the next job to run, or None when every lane is empty, and
+       records how long it waited in its lane and since it was submitted
+    """
+    def get(self, now=None):
+        now = now if (now is not None) else time.time()
+        if (len(self) == 0):
+            return None
+
+        starved = self.getStarved(now)
+        if (starved is not None):
+            lane, n, job = starved
+            self.lanes[lane] = [entry for entry in self.lanes[lane]
+                if (entry[1] != n)]
+            heapq.heapify(self.lanes[lane])
+        else:
+            lane = min([l for l in self.lanes if (len(self.lanes[l]) > 0)],
+                key=lambda l: (self.passes[l], -self.weights[l]))
+            size, n, job = heapq.heappop(self.lanes[lane])
+
+        self.clock = max(self.clock, self.passes[lane])
+        self.passes[lane] = self.passes[lane] + 1.0 / self.weights[lane]
+        self.waits[lane].append((max(0.0, now - job['entered']),
+            max(0.0, now - job['submitted'])))
+        return job
+
+    """Jobs dequeued per lane since the last call, with the mean and longest
+       seconds they waited in the lane and since they were submitted
+    """
+    def getWaitStats(self):
+        stats = {}
+        for lane, waits in self.waits.items():
+            if (len(waits) > 0):
+                in_lane = [w[0] for w in waits]
+                submitted = [w[1] for w in waits]
+                stats[lane] = (len(waits), sum(in_lane) / len(waits),
+                    max(in_lane), sum(submitted) / len(waits),
+                    max(submitted))
+            self.waits[lane] = []
+        return stats
+
+    def getQueued(self):
+        return dict((lane, len(jobs)) for lane, jobs in self.lanes.items())
+
+### EOF
@@ -0,0 +1,161 @@
+# job_pool.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Pool of long-lived annotation workers, forked once from the annotator, that
+# take jobs from a queue with their imports, connections and indexes warm
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import multiprocessing
+import os
+import shutil
+import traceback
+
+import planner as pl
+import run
+
+# Seconds a worker is given to finish its job on shutdown
+POOL_JOIN_TIMEOUT = 30
+
+
+"""Body of a pool worker: warms up, then runs the jobs put on jobs until it
+   gets None, sharding each over its share of the cores of a pool of size
+   workers, and reporting ('started', job id, pid) as it takes each and then
+   ('done', job id, None) or ('failed', job id, error) on results
+"""
+def workerLoop(jobs, results, size=1):
+    options = run.getRunOptions(size)
+    try:
+        run.warmUp(options)
+    except Exception:
+        traceback.print_exc()
+
+    while True:
+        job = jobs.get()
+        if (job is None):
+            break
+        results.put(('started', job['id'], os.getpid()))
+        try:
+            run.runJob(job['path'], options)
+            results.put(('done', job['id'], None))
+        except Exception as e:
+            traceback.print_exc()
+            results.put(('failed', job['id'], str(e)))
+
+
+"""size worker processes forked up front, each running jobs one at a time
+   Workers are not daemons, so a job may still fork its own shard workers;
+   one that dies is replaced, and the job it was running reported failed
+   pending maps every job submitted and not yet finished to the pid of the
+   worker running it, or None while it is queued
+"""
+class JobPool(object):
+    def __init__(self, size):
+        self.size = size
+        self.context = multiprocessing.get_context('fork')
+        self.jobs = self.context.Queue()
+        # Written synchronously, so a result survives its worker dying next
+        self.results = self.context.SimpleQueue()
+        self.pending = {}
+        self.workers = [self.start() for i in range(size)]
+
+    def start(self):
+        worker = self.context.Process(target=workerLoop,
+            args=(self.jobs, self.results, self.size))
+        worker.start()
+        return worker
+
+    """Queues the job whose input is at path; id is reported back by done
+    """
+    def submit(self, id, path):
+        self.pending[id] = None
+        self.jobs.put({'id': id, 'path': path})
+
+    """Workers with no job queued for them
+    """
+    def free(self):
+        return max(0, self.size - len(self.pending))
+
+    def collect(self, finished):
+        while not self.results.empty():
+            event, id, detail = self.results.get()
+            if (id not in self.pending):
+                continue
+            if (event == 'started'):
+                self.pending[id] = detail
+            else:
+                del self.pending[id]
+                finished.append((id, (event == 'done'), detail))
+
+    """(job id, succeeded, error) of every job finished since the last call
+       Workers that died are replaced here, failing the job each was running
+    """
+    def done(self):
+        finished = []
+        self.collect(finished)
+        for i, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            worker.join()
+            self.collect(finished)
+            error = f"Annotation worker {worker.pid} exited with " + \
+                f"{worker.exitcode}"
+            print(error + ", starting another")
+            for id, pid in list(self.pending.items()):
+                if (pid == worker.pid):
+                    del self.pending[id]
+                    finished.append((id, False, error))
+            self.workers[i] = self.start()
+        return finished
+
+    """Lets every worker finish its job and stops the pool
+    """
+    def close(self):
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join(POOL_JOIN_TIMEOUT)
+            if worker.is_alive():
+                worker.terminate()
+
+
+"""Workers in the pool: PoolSize from the [annotator] settings, or one per
+   two cores when it is 0
+"""
+def getPoolSize(config):
+    return int(config['annotator']['PoolSize']) or \
+        max(1, (os.cpu_count() or 2) // 2)
+
+
+"""How many more jobs can be admitted now, and why no more can: one per
+   free worker, as many as job_memory bytes each fit in the memory available
+   and job_disk bytes each in the disk free where jobs_dir is, and none
+   while the load average is at the host's cores
+   Returns (jobs, reason), reason naming the tightest limit
+"""
+def getAdmission(pool, jobs_dir, job_memory=0, job_disk=0):
+    cores = os.cpu_count() or 1
+    load = os.getloadavg()[0]
+    if (load >= cores):
+        return (0, f"load average {load:.1f} on {cores} cores")
+
+    limits = [(pool.free(), f"{pool.free()} of {pool.size} workers free")]
+
+    available = pl.getAvailableMemory()
+    if (available is not None) and (job_memory > 0):
+        limits.append((available // job_memory, 
+            f"{available // (1024 * 1024)} MB of memory available"))
+
+    path = jobs_dir if os.path.isdir(jobs_dir) else \
+        os.path.dirname(os.path.abspath(jobs_dir))
+    disk = shutil.disk_usage(path).free
+    if (job_disk > 0):
+        limits.append((disk // job_disk, 
+            f"{disk // (1024 * 1024)} MB of disk free"))
+
+    return min(limits, key=lambda limit: limit[0])
+
+### EOF
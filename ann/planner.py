@@ -0,0 +1,265 @@
+# planner.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Cost-based choice of how each reference table is looked up for a job:
+# preloaded into an interval index, joined a chunk at a time on the server,
+# swept next to sorted input or queried once per variant; dbSNP is queried
+# once per variant or per chunk, either behind its Bloom filter or not
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import math
+import os
+
+import interval_index as ii
+
+# Plans a table can be looked up with, cheapest to set up first
+PLANS = ('query', 'join', 'sweep', 'index')
+
+# Plans a step with a batch lookup (prefetch) can be looked up with, simplest
+# first
+BATCH_PLANS = ('query', 'batch', 'bloom-query', 'bloom-batch')
+
+# Estimated seconds of one per-variant query, a round trip to the server
+PLAN_QUERY_COST = 0.0005
+
+# Estimated seconds of one chunk's server-side join, on top of a small cost
+# per variant in the chunk
+PLAN_JOIN_COST = 0.05
+PLAN_JOIN_VARIANT_COST = 0.00002
+
+# Estimated seconds of one chunk's batched lookup, a query per chromosome,
+# on top of a small cost per position in it
+PLAN_BATCH_COST = 0.005
+PLAN_BATCH_VARIANT_COST = 0.00001
+
+# Estimated seconds to test one variant against a Bloom filter, and share of
+# a job's variants assumed to pass it, being in the table
+PLAN_BLOOM_TEST_COST = 0.000002
+PLAN_BLOOM_PASS_SHARE = 0.5
+
+# Estimated seconds to fetch one table row into an interval index, and to
+# stream one past sorted input
+PLAN_LOAD_ROW_COST = 0.000005
+PLAN_STREAM_ROW_COST = 0.000002
+
+# Estimated seconds to map a snapshot
+PLAN_SNAPSHOT_COST = 0.01
+
+# Bytes an indexed row costs in memory on top of its length on disk
+PLAN_INDEX_ROW_OVERHEAD = 200
+
+# Share of the available memory indexes may take up
+PLAN_MEMORY_SHARE = 0.5
+
+
+"""Estimated rows and average row length in bytes of each of tables, from
+   the server's table statistics; tables it has none for are left out
+"""
+def getTableStats(cursor, tables):
+    tables = sorted(set(tables))
+    if (len(tables) == 0):
+        return {}
+    cursor.execute('select table_name, table_rows, avg_row_length ' +
+        'from information_schema.tables where table_schema = database() ' +
+        'and table_name in (' + ', '.join(['"' + t + '"' for t in tables]) +
+        ');')
+    return dict([(str(row[0]), (int(row[1] or 0), int(row[2] or 0)))
+        for row in cursor.fetchall()])
+
+
+"""Bytes of memory available to this host's jobs, from /proc/meminfo or,
+   failing that, the free pages; None when neither can be read
+"""
+def getAvailableMemory():
+    try:
+        fh = open('/proc/meminfo')
+        for line in fh:
+            if line.startswith('MemAvailable:'):
+                fh.close()
+                return int(line.split()[1]) * 1024
+        fh.close()
+    except (IOError, ValueError):
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+"""Tables a spec's index is built from: its own and, for the bigRefGene
+   index, the equal tables loaded with it
+"""
+def getSpecTables(spec):
+    if (spec.get('load') is ii.getBigRefGeneIndex):
+        return [spec['table'], 'chrom_pos_equal_base',
+            'chrom_pos_equal_nobase']
+    return [spec['table']]
+
+
+"""Index specs of steps, one per table, in pipeline order
+"""
+def getIndexSpecs(steps):
+    specs = []
+    for step in steps:
+        for spec in step.get('indexes', {}).values():
+            if spec['table'] not in [s['table'] for s in specs]:
+                specs.append(spec)
+    return specs
+
+
+"""Steps with a batch lookup (prefetch), in pipeline order
+"""
+def getBatchSteps(steps):
+    return [step for step in steps if (step.get('prefetch') is not None)]
+
+
+"""Estimated seconds and bytes of memory of every plan step could be
+   looked up with in this job, keyed by plan
+   Queries are split over the workers and the records each annotates at
+   once, batches only over the workers, as a chunk is fetched before its
+   records are annotated; with bloom_file, the filter is mapped once for
+   every worker and only the variants passing it are looked up
+"""
+def getBatchCosts(step, variants, batch_size, workers, depth, bloom_file):
+    workers = max(workers or 1, 1)
+    depth = max(depth or 1, 1)
+
+    costs = {'query': (variants * PLAN_QUERY_COST / (workers * depth), 0)}
+    if (batch_size is not None):
+        chunks = math.ceil(variants / batch_size)
+        costs['batch'] = ((chunks * PLAN_BATCH_COST +
+            variants * PLAN_BATCH_VARIANT_COST) / workers, 0)
+
+    if (step.get('filter') is not None) and (bloom_file is not None) and \
+        os.path.isfile(bloom_file):
+        setup = PLAN_SNAPSHOT_COST + \
+            variants * PLAN_BLOOM_TEST_COST / workers
+        memory = os.path.getsize(bloom_file)
+        costs['bloom-query'] = (setup + costs['query'][0] *
+            PLAN_BLOOM_PASS_SHARE, memory)
+        if (batch_size is not None):
+            costs['bloom-batch'] = (setup + (chunks * PLAN_BATCH_COST +
+                variants * PLAN_BATCH_VARIANT_COST * PLAN_BLOOM_PASS_SHARE) /
+                workers, memory)
+
+    return costs
+
+
+"""Estimated seconds and bytes of memory of every plan table could be
+   looked up with in this job, keyed by plan
+   Per-variant work is split over the workers and, for queries, the records
+   each annotates at once; every worker builds its own index, so indexes
+   cost their load time once and their memory once per worker
+"""
+def getPlanCosts(spec, stats, variants, sorted_input, batch_size, workers,
+    depth, snapshot_dir):
+
+    workers = max(workers or 1, 1)
+    depth = max(depth or 1, 1)
+    tables = getSpecTables(spec)
+    rows = sum([stats.get(t, (0, 0))[0] for t in tables])
+
+    costs = {'query': (variants * PLAN_QUERY_COST / (workers * depth), 0)}
+
+    if ('load' not in spec) and (batch_size is not None):
+        chunks = math.ceil(variants / batch_size)
+        costs['join'] = ((chunks * PLAN_JOIN_COST +
+            variants * PLAN_JOIN_VARIANT_COST) / workers, 0)
+
+    if ('load' not in spec) and sorted_input:
+        costs['sweep'] = (rows * PLAN_STREAM_ROW_COST / workers, 0)
+
+    seconds = 0
+    memory = 0
+    for t in tables:
+        t_rows, t_length = stats.get(t, (0, 0))
+        if (snapshot_dir is not None) and (t == spec['table']) and \
+            os.path.isfile(ii.snapshotPath(snapshot_dir, t)):
+            seconds = seconds + PLAN_SNAPSHOT_COST
+        else:
+            seconds = seconds + t_rows * PLAN_LOAD_ROW_COST
+            memory = memory + \
+                t_rows * (t_length + PLAN_INDEX_ROW_OVERHEAD) * workers
+    costs['index'] = (seconds, memory)
+
+    return costs
+
+
+"""Picks how every indexable table of steps is looked up in this job: the
+   cheapest plan by getPlanCosts, except that indexes only go in while
+   they fit in memory_limit bytes, those saving the most time per byte
+   first; the rest fall back to their next cheapest plan
+   The table of every step with a batch lookup gets the cheapest plan by
+   getBatchCosts first, a Bloom filter taking its memory out of the limit
+   Returns one dict per table, in pipeline order, with its plan, estimated
+   seconds and bytes and the rows the estimate is based on
+"""
+def planLookups(steps, stats, variants, sorted_input=False, batch_size=None,
+    workers=1, depth=None, snapshot_dir=None, memory_limit=None,
+    bloom_file=None):
+
+    budget = memory_limit
+    batch_plans = {}
+    for step in getBatchSteps(steps):
+        costs = getBatchCosts(step, variants, batch_size, workers, depth,
+            bloom_file)
+        plan = min(costs, key=lambda p: (costs[p][0], BATCH_PLANS.index(p)))
+        batch_plans[step['table']] = {'table': step['table'], 'plan': plan,
+            'seconds': costs[plan][0], 'memory': costs[plan][1],
+            'rows': stats.get(step['table'], (0, 0))[0]}
+        if (budget is not None):
+            budget = max(0, budget - costs[plan][1])
+
+    specs = getIndexSpecs(steps)
+    plans = {}
+    candidates = []
+    for spec in specs:
+        costs = getPlanCosts(spec, stats, variants, sorted_input, batch_size,
+            workers, depth, snapshot_dir)
+        ranked = sorted(costs, key=lambda p: (costs[p][0], PLANS.index(p)))
+        plans[spec['table']] = (ranked, costs)
+        if (ranked[0] == 'index') and (costs['index'][1] > 0):
+            fallback = ranked[1]
+            saving = costs[fallback][0] - costs['index'][0]
+            candidates.append((saving / costs['index'][1], spec['table']))
+
+    for saving, table in sorted(candidates, reverse=True):
+        ranked, costs = plans[table]
+        if (budget is not None) and (costs['index'][1] > budget):
+            ranked.remove('index')
+            continue
+        if (budget is not None):
+            budget = budget - costs['index'][1]
+
+    chosen = []
+    for step in steps:
+        if (step.get('table') in batch_plans):
+            chosen.append(batch_plans.pop(step['table']))
+        for spec in step.get('indexes', {}).values():
+            if (spec['table'] not in plans):
+                continue
+            ranked, costs = plans.pop(spec['table'])
+            plan = ranked[0]
+            chosen.append({'table': spec['table'], 'plan': plan,
+                'seconds': costs[plan][0], 'memory': costs[plan][1],
+                'rows': sum([stats.get(t, (0, 0))[0]
+                    for t in getSpecTables(spec)])})
+
+    return chosen
+
+
+"""Writes the chosen plans to the count log, one line per table
+"""
+def writePlanLog(fh_log, plans, variants):
+    fh_log.write(f"Lookup plans for {str(variants)} variants:\n")
+    for plan in plans:
+        fh_log.write(f"{plan['table']}: {plan['plan']} " +
+            f"({str(plan['rows'])} rows, est. {plan['seconds']:.2f} s, " +
+            f"{str(plan['memory'] // (1024 * 1024))} MB)\n")
+
+### EOF
@@ -13,39 +13,171 @@ __author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
 
 import os
 import json
+import time
+import threading
 import pymysql
 import boto3
 from botocore.exceptions import ClientError
 
+"""Reference database connections are pooled per worker process
+   DB_SECRET_TTL: seconds the RDS secret is reused before it is fetched again
+   DB_POOL_SIZE: idle connections kept open between jobs and stages
+"""
+DB_SECRET_TTL = int(os.environ['DB_SECRET_TTL']) if \
+    ('DB_SECRET_TTL' in os.environ) else 300
+DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if \
+    ('DB_POOL_SIZE' in os.environ) else 4
+
+"""MySQL client errors raised when the server connection is lost
+"""
+DB_CONNECTION_LOST = (2006, 2013, 2055)
+DB_ACCESS_DENIED = 1045
+
+db_secret = {'value': None, 'expires': 0}
+db_pool = {'pid': None, 'idle': []}
+db_pool_lock = threading.Lock()
+
+
+"""Get the RDS secret, from AWS Secrets Manager once every DB_SECRET_TTL
+"""
+def get_db_secret(refresh=False):
+    if refresh or (db_secret['value'] is None) or \
+        (time.time() >= db_secret['expires']):
+        AWS_REGION_NAME = os.environ['AWS_REGION_NAME'] if \
+            ('AWS_REGION_NAME' in  os.environ) else "us-east-1"
+
+        asm = boto3.client('secretsmanager', region_name=AWS_REGION_NAME)
+        try:
+            asm_response = asm.get_secret_value(SecretId='rds/anntools_database')
+            db_secret['value'] = json.loads(asm_response['SecretString'])
+            db_secret['expires'] = time.time() + DB_SECRET_TTL
+        except ClientError as e:
+            print(f"Unable to retrieve RDS credentials from AWS Secrets Manager: {e}")
+            raise e
+
+    return db_secret['value']
+
+
+"""Open a new connection to the reference database
+   Connections autocommit: a pooled connection outlives many jobs, and an
+   open transaction would hold one read snapshot (and its undo history) for
+   as long as the worker runs
+"""
+def db_open():
+    rds_secret = get_db_secret()
+    try:
+        return pymysql.connect(
+            host=rds_secret['host'],
+            port=rds_secret['port'],
+            user=rds_secret['username'],
+            passwd=rds_secret['password'],
+            db='annotator',
+            autocommit=True)
+    except pymysql.err.OperationalError as e:
+        # Credentials may have been rotated since the secret was cached
+        if (e.args[0] != DB_ACCESS_DENIED):
+            raise e
+        rds_secret = get_db_secret(refresh=True)
+        return pymysql.connect(
+            host=rds_secret['host'],
+            port=rds_secret['port'],
+            user=rds_secret['username'],
+            passwd=rds_secret['password'],
+            db='annotator',
+            autocommit=True)
+
+
 """Get connection to reference database
+   Connections come from the worker's pool and are checked before reuse;
+   close() hands them back to the pool
 """
 def db_connect():
-    AWS_REGION_NAME = os.environ['AWS_REGION_NAME'] if \
-        ('AWS_REGION_NAME' in  os.environ) else "us-east-1"
+    conn = None
+    with db_pool_lock:
+        # Never share sockets with a parent process after a fork
+        if (db_pool['pid'] != os.getpid()):
+            db_pool['pid'] = os.getpid()
+            db_pool['idle'] = []
+        if (len(db_pool['idle']) > 0):
+            conn = db_pool['idle'].pop()
 
-    # Get RDS secret from AWS Secrets Manager
-    asm = boto3.client('secretsmanager', region_name=AWS_REGION_NAME)
-    try:
-        asm_response = asm.get_secret_value(SecretId='rds/anntools_database')
-        rds_secret = json.loads(asm_response['SecretString'])
-    except ClientError as e:
-        print(f"Unable to retrieve RDS credentials from AWS Secrets Manager: {e}")
-        raise e
-
-    # Extract database connection parameters
-    rds_host = rds_secret['host']
-    mysql_port = rds_secret['port']
-    username = rds_secret['username']
-    password = rds_secret['password']
-    database_name = 'annotator'
-
-    # Return a connection to the database
-    return pymysql.connect(
-        host=rds_host,
-        port=mysql_port,
-        user=username,
-        passwd=password,
-        db=database_name)
+    if (conn is not None):
+        try:
+            conn.ping(reconnect=True)
+        except pymysql.err.Error:
+            conn = None
+
+    if (conn is None):
+        conn = db_open()
+
+    return PooledConnection(conn)
+
+
+"""Return a connection to the pool, or close it if the pool is full
+"""
+def db_release(conn):
+    with db_pool_lock:
+        if (db_pool['pid'] == os.getpid()) and \
+            (len(db_pool['idle']) < DB_POOL_SIZE):
+            db_pool['idle'].append(conn)
+            return
+    conn.close()
+
+
+"""Pooled reference database connection; close() releases it to the pool
+   session counts the times its cursors reconnected, each one starting a
+   new server session without the temporary tables of the last
+"""
+class PooledConnection(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.session = 0
+
+    """unbuffered cursors stream rows from the server as they are fetched
+    """
+    def cursor(self, unbuffered=False):
+        return ReconnectingCursor(self, unbuffered)
+
+    def close(self):
+        if (self.conn is not None):
+            db_release(self.conn)
+            self.conn = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+"""Cursor that reconnects and retries once when the server has gone away
+   Only ever used for read-only lookups, so retrying is safe, except that
+   session temporary tables are gone after a reconnect: users of those
+   compare session before and after and load them again
+"""
+class ReconnectingCursor(object):
+    def __init__(self, pooled, unbuffered=False):
+        self.pooled = pooled
+        self.conn = pooled.conn
+        self.cursor_class = pymysql.cursors.SSCursor if unbuffered else None
+        self.cursor = self.conn.cursor(self.cursor_class)
+
+    """Changes whenever the connection has reconnected
+    """
+    @property
+    def session(self):
+        return self.pooled.session
+
+    def execute(self, query, args=None):
+        try:
+            return self.cursor.execute(query, args)
+        except pymysql.err.OperationalError as e:
+            if (e.args[0] not in DB_CONNECTION_LOST):
+                raise e
+            self.conn.ping(reconnect=True)
+            self.pooled.session = self.pooled.session + 1
+            self.cursor = self.conn.cursor(self.cursor_class)
+            return self.cursor.execute(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
 
 
 """Column inices for pileup and VCF
@@ -109,12 +241,15 @@ def dedup(mylist):
 
 
 """Helper method to parse fields
+   Matches the first field whose name contains key, or with exact, the 
+   first one named key
 """
-def parse_field(text, key, sep1, sep2):
+def parse_field(text, key, sep1, sep2, exact=False):
     fields = text.strip().split(sep1)
     for f in fields:
         pairs = f.split(sep2)
-        if (str(pairs[0]).find(str(key)) > -1):
+        if (str(pairs[0]) == str(key)) or \
+            ((not exact) and (str(pairs[0]).find(str(key)) > -1)):
             return str(pairs[1])
     return '.'
 
@@ -0,0 +1,163 @@
+# variant_cache.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# Persistent cache of variant annotations, shared by the jobs on this host
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import json
+import os
+import sqlite3
+import time
+
+# Seconds a job waits on the cache while another job is writing to it
+CACHE_TIMEOUT = 30
+
+# Most variables SQLite binds in one statement
+CACHE_QUERY_SIZE = 500
+
+
+"""Annotations of variants already seen by a job on this host, kept in a
+   SQLite file and evicted least recently used first past max_entries
+   Each entry records what the whole pipeline did to one record: the INFO
+   it appended (or wrote, when the INFO was '.'), the ID it set, the padding
+   gadAll added to the fields and every step's counters
+   Entries are keyed by variant, by the parts of the incoming record the
+   steps read and by version; opening the cache with a new version empties it
+"""
+class VariantCache(object):
+    def __init__(self, path, version, max_entries=None):
+        if (os.path.dirname(path) != '') and \
+            not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.version = str(version)
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=CACHE_TIMEOUT,
+            isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL;')
+        self.conn.execute('create table if not exists meta ' +
+            '(name text primary key, value text);')
+        self.conn.execute('create table if not exists variants ' +
+            '(key text primary key, version text, value text, used real);')
+        self.conn.execute('create index if not exists variants_used ' +
+            'on variants (used);')
+
+        self.conn.execute('begin immediate;')
+        row = self.conn.execute(
+            "select value from meta where name = 'version';").fetchone()
+        if (row is None) or (row[0] != self.version):
+            self.conn.execute('delete from variants;')
+            self.conn.execute("insert or replace into meta values " +
+                "('version', ?);", (self.version,))
+        self.conn.execute('commit;')
+
+    """Entries of the cached keys among keys, marking them as just used
+    """
+    def getMany(self, keys):
+        keys = list(set(keys))
+        entries = {}
+        for i in range(0, len(keys), CACHE_QUERY_SIZE):
+            part = keys[i:i + CACHE_QUERY_SIZE]
+            sql = 'select key, value from variants where version = ? ' + \
+                'and key in (' + ','.join(['?'] * len(part)) + ');'
+            for key, value in self.conn.execute(sql, [self.version] + part):
+                entries[key] = json.loads(value)
+
+        if (len(entries) > 0):
+            hits = list(entries)
+            now = time.time()
+            self.conn.execute('begin immediate;')
+            for i in range(0, len(hits), CACHE_QUERY_SIZE):
+                part = hits[i:i + CACHE_QUERY_SIZE]
+                self.conn.execute('update variants set used = ? where ' +
+                    'key in (' + ','.join(['?'] * len(part)) + ');',
+                    [now] + part)
+            self.conn.execute('commit;')
+
+        return entries
+
+    def putMany(self, entries):
+        now = time.time()
+        self.conn.execute('begin immediate;')
+        self.conn.executemany('insert or replace into variants ' +
+            'values (?, ?, ?, ?);', [(key, self.version, json.dumps(entry),
+            now) for key, entry in entries.items()])
+        self.conn.execute('commit;')
+
+    """Drops the least recently used entries beyond max_entries
+    """
+    def evict(self):
+        if (self.max_entries is None):
+            return
+        self.conn.execute('delete from variants where key in (select key ' +
+            'from variants order by used desc limit -1 offset ?);',
+            (self.max_entries,))
+
+    def close(self):
+        self.conn.close()
+
+
+"""The parts of an incoming record, besides the variant, that change what
+   the pipeline does to it: an empty ('.') INFO, which dbSNP and BigRefGene
+   overwrite; a '.;' or ';' at either end of INFO; INFO being the last
+   column, which gets stripped between steps; and a positionType already
+   in INFO, which the gene step reads
+   Returns None for records that are not worth caching
+"""
+def getRecordContext(record):
+    fields = record.fields
+    info = fields[7]
+    if (fields[-1] == '') or (info != info.strip()):
+        return None
+
+    try:
+        position_type = record.getInfoField('positionType')
+    except IndexError:
+        return None
+
+    return [info == '.', info.startswith('.;'), info.endswith(';'),
+        len(fields) == 8, position_type]
+
+
+def getCacheKey(record, context):
+    return json.dumps([record.chr, record.chrom, record.pos, record.ref,
+        record.alt] + context)
+
+
+"""The cache entry turning record before into after, or None when after
+   cannot be rebuilt from before and the entry alone
+"""
+def getEntry(before, after, step_counts):
+    pad = len(after[1]) - len(before[1])
+    if (len(after) != len(before)) or (pad < 0):
+        return None
+
+    info = after[7][pad:]
+    if (before[7] != '.'):
+        if not info.startswith(before[7]):
+            return None
+        info = info[len(before[7]):]
+
+    entry = {'id': after[2][pad:], 'pad': pad, 'info': info,
+        'counts': [dict(c) for c in step_counts]}
+    if (applyEntry(list(before), entry) != after):
+        return None
+    return entry
+
+
+"""Annotates a record in place from its cache entry and returns it
+"""
+def applyEntry(fields, entry):
+    if (fields[7] == '.'):
+        fields[7] = entry['info']
+    else:
+        fields[7] = fields[7] + entry['info']
+    fields[2] = entry['id']
+    fields[1:] = [' ' * entry['pad'] + f for f in fields[1:]]
+    return fields
+
+### EOF
@@ -0,0 +1,155 @@
+# vcf_sort.py
+#
+# Copyright (C) 2011-2019 Vas Vasiliadis
+# University of Chicago
+#
+# External merge sort of VCF files by position, within a fixed memory budget
+#
+##
+__author__ = 'Vas Vasiliadis <vas@uchicago.edu>'
+
+import heapq
+import os
+import tempfile
+
+import file_utils as fu
+
+# Bytes a buffered line costs on top of its length
+SORT_LINE_OVERHEAD = 100
+
+# Most runs merged at once; more are merged in several passes
+SORT_FAN_IN = 64
+
+
+"""Sort key of a VCF line: header lines first, then by chromosome (numbered
+   ones in numeric order, then the others by name, "chr" or not) and position
+   Lines that cannot be parsed go last
+"""
+def getPositionKey(n, line):
+    if line.startswith('#'):
+        return (0, 0, '', 0, n)
+
+    fields = line.split('\t', 2)
+    if (len(fields) < 2) or not fields[1].strip().isdigit():
+        return (3, 0, '', 0, n)
+
+    chrom = fields[0].strip().upper()
+    if chrom.startswith('CHR'):
+        chrom = chrom[3:]
+    if chrom.isdigit():
+        return (1, int(chrom), '', int(fields[1]), n)
+    return (2, 0, chrom, int(fields[1]), n)
+
+
+def getLineNumberKey(n, line):
+    return n
+
+
+def writeRun(run, tmpdir):
+    fd, path = tempfile.mkstemp(prefix='sortrun', dir=tmpdir)
+    fh = os.fdopen(fd, 'w')
+    for n, line in run:
+        fh.write(str(n) + '\t' + line + '\n')
+    fh.close()
+    return path
+
+
+def readRun(path, key):
+    fh = open(path)
+    for record in fh:
+        n, line = record.rstrip('\n').split('\t', 1)
+        n = int(n)
+        yield (key(n, line), n, line)
+    fh.close()
+
+
+"""Merges the sorted runs at paths into one and deletes them
+"""
+def mergeRuns(paths, key, tmpdir):
+    merged = writeRun(((n, line) for k, n, line in
+        heapq.merge(*[readRun(path, key) for path in paths])), tmpdir)
+    for path in paths:
+        fu.delete(path)
+    return merged
+
+
+"""Sorts (line number, line) records by key(n, line) with at most about
+   memory_limit bytes of them in memory: sorted runs are spilled to tmpdir
+   and k-way merged, SORT_FAN_IN at a time
+   Yields the records in order
+"""
+def externalSort(records, key, memory_limit, tmpdir=None):
+    runs = []
+    run = []
+    size = 0
+    for n, line in records:
+        run.append((n, line))
+        size = size + len(line) + SORT_LINE_OVERHEAD
+        if (size >= memory_limit):
+            run.sort(key=lambda r: key(r[0], r[1]))
+            runs.append(writeRun(run, tmpdir))
+            run = []
+            size = 0
+
+    run.sort(key=lambda r: key(r[0], r[1]))
+    if (len(runs) == 0):
+        for record in run:
+            yield record
+        return
+
+    if (len(run) > 0):
+        runs.append(writeRun(run, tmpdir))
+    run = []
+
+    while (len(runs) > SORT_FAN_IN):
+        runs = [mergeRuns(runs[i:i + SORT_FAN_IN], key, tmpdir)
+            for i in range(0, len(runs), SORT_FAN_IN)]
+
+    try:
+        for k, n, line in heapq.merge(*[readRun(path, key)
+            for path in runs]):
+            yield (n, line)
+    finally:
+        for path in runs:
+            fu.delete(path)
+
+
+"""Writes infile sorted by position to outfile, header lines first, and the
+   original number of every line written to orderfile, one per line
+"""
+def sortVcf(infile, outfile, orderfile, memory_limit, tmpdir=None):
+    tmpdir = tmpdir or os.path.dirname(os.path.abspath(outfile))
+    fh = open(infile)
+    fh_out = open(outfile, 'w')
+    fh_order = open(orderfile, 'w')
+
+    records = ((n, line.strip()) for n, line in enumerate(fh))
+    for n, line in externalSort(records, getPositionKey, memory_limit,
+        tmpdir):
+        fh_out.write(line + '\n')
+        fh_order.write(str(n) + '\n')
+
+    fh.close()
+    fh_out.close()
+    fh_order.close()
+
+
+"""Rewrites infile, a file line-for-line parallel to the output of sortVcf,
+   into outfile in the order orderfile recorded: the upload order
+"""
+def restoreOrder(infile, orderfile, outfile, memory_limit, tmpdir=None):
+    tmpdir = tmpdir or os.path.dirname(os.path.abspath(outfile))
+    fh = open(infile)
+    fh_order = open(orderfile)
+    fh_out = open(outfile, 'w')
+
+    records = ((int(n), line.rstrip('\n')) for n, line in zip(fh_order, fh))
+    for n, line in externalSort(records, getLineNumberKey, memory_limit,
+        tmpdir):
+        fh_out.write(line + '\n')
+
+    fh.close()
+    fh_order.close()
+    fh_out.close()
+
+### EOF
@@ -30,6 +30,10 @@ import re
 import math
 import time
 
+# S3 client shared by the requests; unlike boto3 resources, clients are safe
+# to share between threads
+s3_client = boto3.client('s3', region_name=app.config['AWS_REGION_NAME'], config=Config(signature_version = 's3v4'))
+
 # Helper function
 def error_response(code, message):
     '''
@@ -151,13 +155,27 @@ def create_annotation_job_request():
         error = e.response['Error']
         return error_response(500, f"Unable to enter item into DynamoDB table: {error['Message']}")
 
-    # Send message to request queue
+    # Send message to request queue, with the user's role and the input's
+    # size so the annotator can schedule jobs in lanes by tier and size; as
+    # message attributes they also route requests to per-lane queues
+    # head_object() from boto3 documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.head_object
+    message = dict(data, user_role=session.get('role'))
+    attributes = {}
+    if session.get('role') is not None:
+        attributes['user_role'] = {'DataType': 'String', 'StringValue': session.get('role')}
+    try:
+        input_size = s3_client.head_object(Bucket=bucket_name, Key=s3_key)['ContentLength']
+        attributes['input_size'] = {'DataType': 'Number', 'StringValue': str(input_size)}
+    except ClientError:
+        # Unsized requests are left to the annotator's requests queue
+        pass
+
     # Publish a notification message to the SNS topic
     sns = boto3.client('sns', region_name=app.config['AWS_REGION_NAME'], config=Config(signature_version = 's3v4'))
 
     # Exceptions found in SNS publish() documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sns.html#SNS.Client.publish
     try:
-        sns_publish = sns.publish(TopicArn=app.config['AWS_SNS_JOB_REQUEST_TOPIC'], Message=json.dumps(data), MessageStructure='string')
+        sns_publish = sns.publish(TopicArn=app.config['AWS_SNS_JOB_REQUEST_TOPIC'], Message=json.dumps(message), MessageStructure='string', MessageAttributes=attributes)
     except ClientError as e:
         error = e.response['Error']
         return error_response(500, f"Unable to publish message to request SNS: {error['Message']}")